@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = '.jackbuild.json'
+
+
+def hashFile(fp):
+    with open(fp, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def outputPath(fp):
+    fpNoExt, _ = os.path.splitext(fp)
+    return fpNoExt + '.vm'
+
+
+class BuildCache:
+
+    # A manifest, kept in the output directory, of the source and output
+    # hashes of every class compiled there. An output is still valid while
+    # its source, the compiler version and the settings are all unchanged
+    def __init__(self, outputDir, version, settings=None):
+        self.path = os.path.join(outputDir, MANIFEST_NAME)
+        self.version = version
+        self.settings = settings or {}
+        self.entries = dict()
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as manifestFile:
+                manifest = json.load(manifestFile)
+        except (OSError, ValueError):
+            return
+
+        # A different compiler or different options invalidate everything
+        if manifest.get('version') == self.version \
+                and manifest.get('settings') == self.settings:
+            self.entries = manifest.get('files', {})
+
+    def save(self):
+        manifest = {'version': self.version,
+                    'settings': self.settings,
+                    'files': self.entries}
+        with open(self.path, 'w') as manifestFile:
+            json.dump(manifest, manifestFile, indent=1, sort_keys=True)
+
+    def isValid(self, fp, sourceHash):
+        entry = self.entries.get(os.path.basename(fp))
+        if not entry or entry['source'] != sourceHash:
+            return False
+
+        # The output could have been edited or removed behind our back
+        outputFp = outputPath(fp)
+        return os.path.isfile(outputFp) and hashFile(outputFp) == entry['output']
+
+    def record(self, fp, sourceHash):
+        self.entries[os.path.basename(fp)] = {
+            'source': sourceHash,
+            'output': hashFile(outputPath(fp))}
+
+    def forget(self, fp):
+        self.entries.pop(os.path.basename(fp), None)
+
+    def prune(self, sources):
+        # Drop entries of sources that no longer exist
+        names = {os.path.basename(fp) for fp in sources}
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
+
+    def clean(self, sources):
+        # Remove the outputs of the given sources and the manifest itself
+        removed = 0
+        for fp in sources:
+            outputFp = outputPath(fp)
+            if os.path.isfile(outputFp):
+                os.remove(outputFp)
+                removed += 1
+
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        self.entries = dict()
+
+        return removed
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+from JackTokenizer import JackTokenizer
+from BuildCache import hashFile
+from CompilationTypes import JackError
+
+INDEX_NAME = '.jackindex.json'
+# Bump whenever the format of the index changes
+INDEX_VERSION = 1
+
+SUBROUTINE_KINDS = ('constructor', 'function', 'method')
+
+# paramCount leaves out the implicit 'this' of methods
+Signature = namedtuple('Signature', ['kind', 'returnType', 'paramCount'])
+
+
+def scanSignatures(source):
+    # The class name and {subroutine name: Signature} of a class, read from
+    # its declarations alone, without compiling the bodies
+    tokens = JackTokenizer(source).tokens
+    className = None
+    signatures = dict()
+
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        lexType = tokens.type(i)
+        value = tokens.value(i)
+        if lexType == 'symbol' and value == '{':
+            depth += 1
+        elif lexType == 'symbol' and value == '}':
+            depth -= 1
+        elif lexType == 'keyword' and value == 'class' and className is None:
+            className = tokens.value(i + 1)
+        elif lexType == 'keyword' and depth == 1 and value in SUBROUTINE_KINDS:
+            returnType = tokens.value(i + 1)
+            name = tokens.value(i + 2)
+
+            # Parameters are separated by commas, past the '('
+            i += 4
+            paramCount = 0
+            if tokens.value(i) != ')':
+                paramCount = 1
+            while tokens.value(i) != ')':
+                paramCount += tokens.value(i) == ','
+                i += 1
+
+            signatures[name] = Signature(value, returnType, paramCount)
+        i += 1
+
+    return className, signatures
+
+
+class ClassIndex:
+
+    # The signature of every subroutine of the classes of a project, kept in
+    # the source directory. Updating it only scans again the sources whose
+    # content changed since
+    def __init__(self, dirPath):
+        self.path = os.path.join(dirPath, INDEX_NAME)
+        # {file name: {'hash', 'class', 'subroutines'}}, as stored
+        self.entries = dict()
+        # {class name: {subroutine name: Signature}}, for lookups
+        self.classes = dict()
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as indexFile:
+                index = json.load(indexFile)
+        except (OSError, ValueError):
+            return
+
+        if index.get('version') == INDEX_VERSION:
+            self.entries = index.get('files', {})
+            self.build()
+
+    def save(self):
+        index = {'version': INDEX_VERSION, 'files': self.entries}
+        with open(self.path, 'w') as indexFile:
+            json.dump(index, indexFile, indent=1, sort_keys=True)
+
+    def build(self):
+        self.classes = {entry['class']: {
+            name: Signature(*signature)
+            for name, signature in entry['subroutines'].items()}
+            for entry in self.entries.values()}
+
+    def update(self, sources):
+        # Scan the new and changed sources, and drop the removed ones.
+        # Returns the number of sources scanned
+        names = {os.path.basename(fp) for fp in sources}
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
+
+        scanned = 0
+        for fp in sources:
+            name = os.path.basename(fp)
+            sourceHash = hashFile(fp)
+            entry = self.entries.get(name)
+            if entry and entry['hash'] == sourceHash:
+                continue
+
+            scanned += 1
+            with open(fp, 'r') as inputFile:
+                source = inputFile.read()
+            try:
+                # A broken class is left out, compiling it reports why
+                className, signatures = scanSignatures(source)
+            except (JackError, IndexError):
+                className = None
+
+            if className is None:
+                self.entries.pop(name, None)
+                continue
+            self.entries[name] = {
+                'hash': sourceHash,
+                'class': className,
+                'subroutines': {subroutine: list(signature)
+                                for subroutine, signature
+                                in signatures.items()}}
+
+        self.build()
+        return scanned
+
+    def hasClass(self, className):
+        return className in self.classes
+
+    def lookup(self, className, name):
+        subroutines = self.classes.get(className)
+        return subroutines.get(name) if subroutines else None
+
+    def fingerprint(self):
+        # Changes whenever any signature does, as that may change the code
+        # of the classes calling it
+        signatures = json.dumps(
+            {className: {name: list(signature)
+                         for name, signature in subroutines.items()}
+             for className, subroutines in self.classes.items()},
+            sort_keys=True)
+        return hashlib.sha256(signatures.encode()).hexdigest()
+
+    def clean(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        self.entries = dict()
+        self.classes = dict()
@@ -1,36 +1,151 @@
 import VMWriter
+import HackWriter
+import VMOptimizer
+import LoopInvariants
 import CompilationTypes
 
 INDENT = 2
+# The static of the pooled string literals of a class, and the function
+# building them. '$' can't start a Jack name
+STRING_TABLE = '$strings'
 biOpActions = {'+': 'add',                      '-': 'sub',
                '*': 'call Math.multiply 2',     '/': 'call Math.divide 2',
                '&': 'and',                      '|': 'or',
                '<': 'lt',                       '>': 'gt',
                '=': 'eq'}
 
+# How unused variables of each kind are named in warnings
+kindNames = {'static': 'static', 'field': 'field', 'arg': 'argument',
+             'var': 'local'}
+
 unaryOpActions = {'-': 'neg',                   '~': 'not',
                   '^': 'shiftleft',             '#': 'shiftright'}
 
-labelCount = 0
 
+def divide(a, b):
+    # Math.divide truncates towards zero, division by zero is left for the
+    # run time to report
+    if b == 0:
+        return None
 
-class CompilationEngine:
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+# Compile time evaluation of operators on constants, wrapped to 16 bits by
+# the writer. Comparisons give Jack's true (-1) and false (0)
+biOpFolds = {'+': lambda a, b: a + b,       '-': lambda a, b: a - b,
+             '*': lambda a, b: a * b,       '/': divide,
+             '&': lambda a, b: a & b,       '|': lambda a, b: a | b,
+             '<': lambda a, b: -(a < b),    '>': lambda a, b: -(a > b),
+             '=': lambda a, b: -(a == b)}
+
+unaryOpFolds = {'-': lambda a: -a,          '~': lambda a: ~a}
+
+# The writer for each target language
+writers = {'vm': VMWriter.VMWriter, 'asm': HackWriter.HackWriter}
 
-    def __init__(self, tokenizer, oStream):
-        self.tokenizer = tokenizer
-        self.vmWriter = VMWriter.VMWriter(oStream)
 
-    @staticmethod
-    def getLabel():
-        global labelCount
+class CompilationEngine:
 
-        label = 'L{}'.format(labelCount)
-        labelCount += 1
+    def __init__(self, tokenizer, oStream, chunkSize=None, optimize=False,
+                 index=None, iterative=False, target='vm',
+                 poolStrings=False, printWarnings=True, warnUnused=False):
+        self.tokenizer = tokenizer
+        optimizer = VMOptimizer.VMOptimizer() if optimize else None
+        self.vmWriter = writers[target](oStream, chunkSize, optimizer)
+        self.optimize = optimize
+        # A ClassIndex of the project, to check calls against the signatures
+        # of the other classes
+        self.index = index
+        self.warnings = []
+        # Warnings are only collected if not printed, as when embedded
+        self.printWarnings = printWarnings
+        # Compile expressions from an explicit stack instead of recursively
+        self.iterative = iterative
+        # Build each string literal once, kept in a static of the class
+        self.poolStrings = poolStrings
+        # Warn about the variables that are declared but never used
+        self.warnUnused = warnUnused
+        # Labels are numbered per class, so a class compiles to the same code
+        # whatever else is compiled in the same run, and in whichever order
+        self.labelCount = 0
+        # With optimize, ((symbol, address code), buffer position) of the
+        # array base last popped into pointer 1 in the current statement
+        self.thatBase = None
+
+    def getLabel(self):
+        label = 'L{}'.format(self.labelCount)
+        self.labelCount += 1
 
         return label
 
+    def warn(self, message, line, jackClass, jackSubroutine=None):
+        # Problems found through the index or the symbol tables don't stop
+        # the compilation
+        where = jackClass.name
+        if jackSubroutine is not None:
+            where = '{}.{}'.format(where, jackSubroutine.name)
+        warning = 'Warning: {}: {} at line {}'.format(where, message, line)
+        self.warnings.append(warning)
+        if self.printWarnings:
+            print(warning)
+
+    def checkCall(self, jackSubroutine, jackCall):
+        # Calls into classes that aren't indexed, such as the OS, are trusted
+        if not self.index.hasClass(jackCall.className):
+            return
+
+        fullName = '{}.{}'.format(jackCall.className, jackCall.name)
+        signature = self.index.lookup(jackCall.className, jackCall.name)
+        line = jackCall.token.line
+        jackClass = jackSubroutine.jackClass
+        if signature is None:
+            self.warn('call to undefined subroutine {}'.format(fullName),
+                      line, jackClass, jackSubroutine)
+            return
+
+        isMethodCall = jackCall.isMethodCall
+        if signature.kind == 'method' and not isMethodCall:
+            self.warn('method {} called without an object'.format(fullName),
+                      line, jackClass, jackSubroutine)
+        elif signature.kind != 'method' and isMethodCall:
+            self.warn('{} {} called on an object'.format(
+                signature.kind, fullName), line, jackClass, jackSubroutine)
+        elif jackCall.defaultCall and signature.kind == 'method' \
+                and jackSubroutine.subroutineType == 'function':
+            self.warn('method {} called from a function'.format(fullName),
+                      line, jackClass, jackSubroutine)
+
+        if jackCall.argCount != signature.paramCount + isMethodCall:
+            self.warn('{} expects {} arguments, got {}'.format(
+                fullName, signature.paramCount,
+                jackCall.argCount - isMethodCall), line, jackClass,
+                jackSubroutine)
+
+    def warnUnusedSymbols(self, symbols, jackClass, jackSubroutine=None):
+        # 'this' is declared by the compiler, not the source
+        for jackSymbol in symbols:
+            if jackSymbol.name != 'this':
+                problem = 'never read' if jackSymbol.writes else 'never used'
+                self.warn('{} {} is {}'.format(
+                    kindNames[jackSymbol.kind], jackSymbol.name, problem),
+                    jackSymbol.line, jackClass, jackSubroutine)
+
+    def syntaxError(self, token, message):
+        if token is None:
+            return CompilationTypes.JackSyntaxError(
+                '{} at the end of the file'.format(message))
+        return CompilationTypes.JackSyntaxError(
+            '{}, found {}'.format(message, token.value), token.line,
+            token.column)
+
     def compileClass(self):
-        self.tokenizer.advance()  # class
+        # Only the outline of the class is checked, a broken subroutine
+        # usually ends up taking the class's closing brace
+        token = self.tokenizer.advance()  # class
+        if token != ('keyword', 'class'):
+            raise self.syntaxError(token, "expected 'class'")
 
         # class name
         className = self.tokenizer.advance().value
@@ -40,8 +155,19 @@ class CompilationEngine:
 
         self.compileClassVars(jackClass)
         self.compileClassSubroutines(jackClass)
+        if jackClass.strings:
+            self.writeStringTable(jackClass)
+        if self.warnUnused:
+            self.warnUnusedSymbols(jackClass.unusedSymbols(), jackClass)
+
+        token = self.tokenizer.advance()  # }
+        if token != ('symbol', '}'):
+            raise self.syntaxError(token, "expected '}' closing the class")
+        token = self.tokenizer.curToken()
+        if token is not None:
+            raise self.syntaxError(token, 'expected the end of the file')
 
-        self.tokenizer.advance()  # }
+        self.vmWriter.flush()
 
     def compileClassVars(self, jackClass):
         token = self.tokenizer.curToken()
@@ -56,12 +182,13 @@ class CompilationEngine:
             stillVars = True
             while stillVars:
                 # var name
-                varName = self.tokenizer.advance().value
+                token = self.tokenizer.advance()
+                varName = token.value
 
                 if isStatic:
-                    jackClass.addStatic(varName, varType)
+                    jackClass.addStatic(varName, varType, token.line)
                 else:
-                    jackClass.addField(varName, varType)
+                    jackClass.addField(varName, varType, token.line)
 
                 token = self.tokenizer.advance()
                 stillVars = token == ('symbol', ',')
@@ -100,9 +227,9 @@ class CompilationEngine:
             token = self.tokenizer.advance()  # Don't advance to avoid eating
             paramType = token.value
             # param name
-            paramName = self.tokenizer.advance().value
+            token = self.tokenizer.advance()
 
-            jackSubroutine.addArg(paramName, paramType)
+            jackSubroutine.addArg(token.value, paramType, token.line)
 
             token = self.tokenizer.curToken()
             # If there are still vars
@@ -120,6 +247,7 @@ class CompilationEngine:
         self.compileSubroutineVars(jackSubroutine)
 
         self.vmWriter.writeFunction(jackSubroutine)
+        header = self.vmWriter.mark() - 1
 
         if jackSubroutine.subroutineType == 'constructor':
             fieldCount = jackSubroutine.jackClass.fieldSymbols
@@ -133,6 +261,16 @@ class CompilationEngine:
 
         self.compileStatements(jackSubroutine)
 
+        # Hoisting loop invariants may have added locals
+        self.vmWriter.updateFunction(header, jackSubroutine)
+
+        if self.warnUnused:
+            self.warnUnusedSymbols(jackSubroutine.unusedSymbols(),
+                                   jackSubroutine.jackClass, jackSubroutine)
+        # Every reference to the symbols was compiled, only the class's
+        # symbols are still needed
+        jackSubroutine.release()
+
         self.tokenizer.advance()  # }
 
     def compileSubroutineVars(self, jackSubroutine):
@@ -144,15 +282,15 @@ class CompilationEngine:
             # varType
             varType = self.tokenizer.advance().value
             # varName
-            varName = self.tokenizer.advance().value
+            token = self.tokenizer.advance()
 
-            jackSubroutine.addVar(varName, varType)
+            jackSubroutine.addVar(token.value, varType, token.line)
 
             # repeat as long as there are parameters, o.w eats the semicolon
             while self.tokenizer.advance().value == ',':
                 # varName
-                varName = self.tokenizer.advance().value
-                jackSubroutine.addVar(varName, varType)
+                token = self.tokenizer.advance()
+                jackSubroutine.addVar(token.value, varType, token.line)
 
             token = self.tokenizer.curToken()
 
@@ -161,6 +299,7 @@ class CompilationEngine:
         checkStatements = True
         while checkStatements:
             token = self.tokenizer.curToken()
+            self.thatBase = None
 
             if token == ('keyword', 'if'):
                 self.compileStatementIf(jackSubroutine)
@@ -179,13 +318,19 @@ class CompilationEngine:
         self.tokenizer.advance()  # if
         self.tokenizer.advance()  # (
 
+        condition = self.vmWriter.mark()
         self.compileExpression(jackSubroutine)
 
         self.tokenizer.advance()  # )
         self.tokenizer.advance()  # {
 
-        falseLabel = CompilationEngine.getLabel()
-        endLabel = CompilationEngine.getLabel()
+        falseLabel = self.getLabel()
+        endLabel = self.getLabel()
+
+        if self.optimize:
+            self.compileBranches(jackSubroutine, condition, falseLabel,
+                                 endLabel)
+            return
 
         self.vmWriter.writeIf(falseLabel)
 
@@ -209,12 +354,122 @@ class CompilationEngine:
 
         self.vmWriter.writeLabel(endLabel)
 
+    def compileBranches(self, jackSubroutine, condition, falseLabel,
+                        endLabel):
+        # The optimized if, once its condition is compiled from condition,
+        # up to the end of its else if there is one. Conditions only hold
+        # if they are true (-1), as the plain 'not' / 'if-goto' test
+        value = self.vmWriter.constantAt(condition)
+        if value is not None:
+            # Only one of the branches is ever taken, the other is dropped
+            self.removeCode(condition)
+            thenStart = self.vmWriter.mark()
+            self.compileStatements(jackSubroutine)
+            self.tokenizer.advance()  # }
+            if value != -1:
+                self.removeCode(thenStart)
+
+            if self.tokenizer.curToken() == ('keyword', 'else'):
+                self.tokenizer.advance()  # else
+                self.tokenizer.advance()  # {
+                elseStart = self.vmWriter.mark()
+                self.compileStatements(jackSubroutine)
+                self.tokenizer.advance()  # }
+                if value == -1:
+                    self.removeCode(elseStart)
+            return
+
+        inverted = self.invertCondition(condition)
+        if inverted or not self.vmWriter.isBoolean(condition):
+            # Jump over the then branch on the negated condition
+            if inverted:
+                self.vmWriter.writeIfTrue(falseLabel)
+            else:
+                self.vmWriter.writeIf(falseLabel)
+            self.compileStatements(jackSubroutine)
+            self.tokenizer.advance()  # }
+
+            if self.tokenizer.curToken() != ('keyword', 'else'):
+                self.vmWriter.writeLabel(falseLabel)
+                return
+
+            self.vmWriter.writeGoto(endLabel)
+            self.vmWriter.writeLabel(falseLabel)
+            self.tokenizer.advance()  # else
+            self.tokenizer.advance()  # {
+            self.compileStatements(jackSubroutine)
+            self.tokenizer.advance()  # }
+            self.vmWriter.writeLabel(endLabel)
+            return
+
+        # Otherwise jump to the then branch on the condition itself, the
+        # then branch being moved after the else one:
+        #   cond / if-goto THEN / else / goto END / label THEN / then / END
+        thenLabel = falseLabel
+        self.vmWriter.writeIfTrue(thenLabel)
+        thenStart = self.vmWriter.mark()
+        self.compileStatements(jackSubroutine)
+        self.tokenizer.advance()  # }
+        thenCode = self.vmWriter.instructions[thenStart:]
+        self.removeCode(thenStart)
+
+        if self.tokenizer.curToken() == ('keyword', 'else'):
+            self.tokenizer.advance()  # else
+            self.tokenizer.advance()  # {
+            self.compileStatements(jackSubroutine)
+            self.tokenizer.advance()  # }
+
+        self.vmWriter.writeGoto(endLabel)
+        self.vmWriter.writeLabel(thenLabel)
+        self.vmWriter.instructions.extend(thenCode)
+        self.vmWriter.writeLabel(endLabel)
+
+    def invertCondition(self, condition):
+        # Negate the condition compiled from condition in place, without
+        # adding a 'not'. Returns whether it could
+        instructions = self.vmWriter.instructions
+        opcode = instructions[-1][0]
+        if opcode == 'not':
+            self.removeCode(-1)
+            return True
+        elif opcode not in ('lt', 'gt'):
+            return False
+
+        # A constant right operand is the one or two instructions before,
+        # x < c is then negated as x > c - 1, and x > c as x < c + 1
+        compare = len(instructions) - 1
+        for operand in (compare - 1, compare - 2):
+            if operand < condition:
+                return False
+            value = self.vmWriter.constantAt(operand, compare)
+            if value is not None:
+                break
+        else:
+            return False
+
+        if opcode == 'lt' and value > -0x8000:
+            self.removeCode(operand)
+            self.vmWriter.writeConstant(value - 1)
+            self.vmWriter.write('gt')
+        elif opcode == 'gt' and value < 0x7FFF:
+            self.removeCode(operand)
+            self.vmWriter.writeConstant(value + 1)
+            self.vmWriter.write('lt')
+        else:
+            return False
+
+        return True
+
     def compileStatementWhile(self, jackSubroutine):
         self.tokenizer.advance()  # while
         self.tokenizer.advance()  # (
 
-        whileLabel = CompilationEngine.getLabel()
-        falseLabel = CompilationEngine.getLabel()
+        whileLabel = self.getLabel()
+        falseLabel = self.getLabel()
+
+        if self.optimize:
+            self.compileLoop(jackSubroutine, whileLabel, falseLabel)
+            return
 
         self.vmWriter.writeLabel(whileLabel)
         self.compileExpression(jackSubroutine)
@@ -232,13 +487,98 @@ class CompilationEngine:
 
         self.tokenizer.advance()  # }
 
+    def compileLoop(self, jackSubroutine, bodyLabel, testLabel):
+        # The optimized while, rotated so a boolean condition is tested at
+        # the bottom, with a single jump per iteration:
+        #   goto TEST / label BODY / body / label TEST / cond / if-goto BODY
+        condition = self.vmWriter.mark()
+        self.compileExpression(jackSubroutine)
+        value = self.vmWriter.constantAt(condition)
+        rotate = self.vmWriter.isBoolean(condition)
+        conditionCode = self.vmWriter.instructions[condition:]
+
+        self.tokenizer.advance()  # )
+        self.tokenizer.advance()  # {
+
+        if value is not None or rotate:
+            self.removeCode(condition)
+            if value is None:
+                self.vmWriter.writeGoto(testLabel)
+            self.vmWriter.writeLabel(bodyLabel)
+        else:
+            # Any other value only holds if it's -1, tested at the top
+            self.vmWriter.instructions.insert(
+                condition, ('label', bodyLabel, None))
+            self.vmWriter.writeIf(testLabel)
+
+        body = self.vmWriter.mark()
+        self.compileStatements(jackSubroutine)
+        self.tokenizer.advance()  # }
+
+        if value is not None and value != -1:
+            # Never runs
+            self.removeCode(body - 1)
+        elif value is not None:
+            self.vmWriter.writeGoto(bodyLabel)
+        elif rotate:
+            self.vmWriter.writeLabel(testLabel)
+            self.vmWriter.instructions.extend(conditionCode)
+            self.vmWriter.writeIfTrue(bodyLabel)
+        else:
+            self.vmWriter.writeGoto(bodyLabel)
+            self.vmWriter.writeLabel(testLabel)
+
+        if value is None or value == -1:
+            self.hoistInvariants(jackSubroutine, condition)
+
+    def hoistInvariants(self, jackSubroutine, loop):
+        # Compute the expressions of the loop from loop that are the same on
+        # every iteration once before it, each into a local of its own.
+        # Hoisted expressions are pure, so computing them even if the loop
+        # doesn't run is harmless
+        instructions = self.vmWriter.instructions
+        ranges = LoopInvariants.findInvariants(instructions[loop:])
+        if not ranges:
+            return
+
+        hoisted = dict()  # {expression code: local}
+        header = []
+        body = []
+        position = loop
+        for start, end in ranges:
+            start += loop
+            end += loop
+            expression = tuple(instructions[start:end])
+            if expression not in hoisted:
+                # '$' can't start a Jack name
+                name = '${}'.format(jackSubroutine.varSymbols)
+                jackSubroutine.addVar(name, 'int')
+                hoisted[expression] = jackSubroutine.getSymbol(name).id
+                header.extend(expression)
+                header.append(('pop', 'local', str(hoisted[expression])))
+
+            body.extend(instructions[position:start])
+            body.append(('push', 'local', str(hoisted[expression])))
+            position = end
+
+        body.extend(instructions[position:])
+        instructions[loop:] = header + body
+        # The loop's code moved
+        self.thatBase = None
+
     def compileStatementLet(self, jackSubroutine):
         self.tokenizer.advance()  # let
         varName = self.tokenizer.advance().value  # var name
-        jackSymbol = jackSubroutine.getSymbol(varName)
 
         isArray = self.tokenizer.curToken().value == '['
+        # Storing into an array reads the variable holding it
         if isArray:
+            jackSymbol = jackSubroutine.readSymbol(varName)
+        else:
+            jackSymbol = jackSubroutine.writeSymbol(varName)
+        if isArray and self.optimize:
+            self.compileArrayStore(jackSubroutine, jackSymbol)
+        elif isArray:
             self.tokenizer.advance()  # [
             self.compileExpression(jackSubroutine)  # Index
             self.tokenizer.advance()  # ]
@@ -261,6 +601,45 @@ class CompilationEngine:
 
         self.tokenizer.advance()  # ;
 
+    def compileArrayStore(self, jackSubroutine, jackSymbol):
+        # The optimized let of an array element, from its '['
+        self.tokenizer.advance()  # [
+        index = self.vmWriter.mark()
+        self.compileExpression(jackSubroutine)  # Index
+        self.tokenizer.advance()  # ]
+        self.tokenizer.advance()  # =
+        addressCode = self.vmWriter.instructions[index:]
+
+        if self.vmWriter.isPure(index) and not self.callsAhead():
+            # Nothing can change the array or the index while the value is
+            # computed, so 'that' is set first and its reads of the element
+            # reuse it. The address is only computed again if they pointed
+            # 'that' elsewhere
+            self.writeArrayBase(jackSymbol, index)
+            self.compileExpression(jackSubroutine)  # Expression to assign
+            address = self.vmWriter.mark()
+            self.vmWriter.instructions.extend(addressCode)
+            offset = self.writeArrayBase(jackSymbol, address)
+            self.vmWriter.writePop('that', offset)
+        elif jackSymbol.kind in ('var', 'arg') and self.vmWriter.onlyReads(
+                index, ('constant', 'local', 'argument')):
+            # Calls can't change locals and arguments, so the address can be
+            # computed after the value instead of being kept on the stack
+            self.removeCode(index)
+            self.compileExpression(jackSubroutine)  # Expression to assign
+            address = self.vmWriter.mark()
+            self.vmWriter.instructions.extend(addressCode)
+            offset = self.writeArrayBase(jackSymbol, address)
+            self.vmWriter.writePop('that', offset)
+        else:
+            self.vmWriter.writePushSymbol(jackSymbol)
+            self.vmWriter.write('add')
+            self.compileExpression(jackSubroutine)  # Expression to assign
+            self.vmWriter.writePop('temp', 0)
+            self.vmWriter.writePop('pointer', 1)
+            self.vmWriter.writePush('temp', 0)
+            self.vmWriter.writePop('that', 0)
+
     def compileStatementDo(self, jackSubroutine):
         self.tokenizer.advance()  # do
 
@@ -299,30 +678,150 @@ class CompilationEngine:
         return count
 
     def compileExpression(self, jackSubroutine):
+        if self.iterative:
+            self.compileExpressionIterative(jackSubroutine)
+            return
+
+        start = self.vmWriter.mark()
         self.compileTerm(jackSubroutine)
 
         token = self.tokenizer.curToken()
         while token.value in '+-*/&|<>=':
             binaryOp = self.tokenizer.advance().value
 
+            operand = self.vmWriter.mark()
             self.compileTerm(jackSubroutine)
-            self.vmWriter.write(biOpActions[binaryOp])
+            self.writeBinaryOp(binaryOp, start, operand)
 
             token = self.tokenizer.curToken()
 
+    def writeBinaryOp(self, binaryOp, start, operand):
+        # The left operand's code begins at start, and the right one's at
+        # operand, so constant operands can be folded away when optimizing
+        if self.optimize:
+            left = self.vmWriter.constantAt(start, operand)
+            right = self.vmWriter.constantAt(operand)
+
+            if left is not None and right is not None:
+                value = biOpFolds[binaryOp](left, right)
+                if value is not None:
+                    self.removeCode(start)
+                    self.vmWriter.writeConstant(value)
+                    return
+            elif left is not None or right is not None:
+                if self.reduceBinaryOp(binaryOp, start, operand, left, right):
+                    return
+
+        self.vmWriter.write(biOpActions[binaryOp])
+
+    def reduceBinaryOp(self, binaryOp, start, operand, left, right):
+        # Strength reduction of an operation with a single constant operand,
+        # returns whether the operation was written
+        if right is not None:
+            constant = right
+            constantStart, constantEnd = operand, None
+        elif binaryOp in '+*&|' or (binaryOp == '-' and left == 0):
+            constant = left
+            constantStart, constantEnd = start, operand
+        else:
+            return False
+
+        isRight = right is not None
+        if (binaryOp in '+|' and constant == 0) \
+                or (binaryOp == '-' and isRight and constant == 0) \
+                or (binaryOp == '*' and constant == 1) \
+                or (binaryOp == '/' and constant == 1) \
+                or (binaryOp == '&' and constant == -1):
+            # Identities, only the other operand is left
+            self.removeCode(constantStart, constantEnd)
+        elif (binaryOp == '-' and not isRight) \
+                or (binaryOp in '*/' and constant == -1):
+            # 0 - x, x * -1 and x / -1
+            self.removeCode(constantStart, constantEnd)
+            self.vmWriter.write('neg')
+        elif (binaryOp in '*&' and constant == 0) \
+                or (binaryOp == '|' and constant == -1):
+            # Absorbing constants, as long as the other operand has no side
+            # effects to keep
+            if not self.vmWriter.isPure(start):
+                return False
+            self.removeCode(start)
+            self.vmWriter.writeConstant(constant)
+        elif binaryOp == '*' and constant > 1 and constant & (constant - 1) == 0:
+            self.removeCode(constantStart, constantEnd)
+            self.writeDoubling(start, constant.bit_length() - 1)
+        else:
+            return False
+
+        return True
+
+    def writeDoubling(self, start, times):
+        # Multiply the value computed from start by 2^times, with additions
+        # instead of a call to Math.multiply
+        instructions = self.vmWriter.instructions[start:]
+        if len(instructions) == 1 and instructions[0][0] == 'push':
+            # A single push is cheaper to repeat than to copy through temp
+            self.vmWriter.instructions.append(instructions[0])
+            self.vmWriter.write('add')
+            times -= 1
+
+        for _ in range(times):
+            self.vmWriter.writePop('temp', 0)
+            self.vmWriter.writePush('temp', 0)
+            self.vmWriter.writePush('temp', 0)
+            self.vmWriter.write('add')
+
+    def writeUnaryOp(self, unaryOp, operand):
+        if self.optimize and unaryOp in unaryOpFolds:
+            value = self.vmWriter.constantAt(operand)
+            if value is not None:
+                self.removeCode(operand)
+                self.vmWriter.writeConstant(unaryOpFolds[unaryOp](value))
+                return
+
+        self.vmWriter.write(unaryOpActions[unaryOp])
+
     def compileTerm(self, jackSubroutine):
 
         token = self.tokenizer.advance()
         # In case of unary operator, compile the term after the operator
         if token.value in unaryOpActions:
+            operand = self.vmWriter.mark()
             self.compileTerm(jackSubroutine)
-            self.vmWriter.write(unaryOpActions[token.value])
+            self.writeUnaryOp(token.value, operand)
         # In case of opening parenthesis for an expression
         elif token.value == '(':
             self.compileExpression(jackSubroutine)
             self.tokenizer.advance()  # )
-        elif token.type == 'integerConstant':
+        # In case of a function call or variable name
+        elif token.type == 'identifier':
+            # Save token value as symbol and function in case of both
+            tokenVar = jackSubroutine.readSymbol(token.value)
+
+            if self.tokenizer.curToken().value == '[':  # Array
+                self.tokenizer.advance()  # [
+                index = self.vmWriter.mark()
+                self.compileExpression(jackSubroutine)
+                self.writeArrayRead(tokenVar, index)
+                self.tokenizer.advance()  # ]
+            else:
+                jackCall = self.compileCallStart(
+                    jackSubroutine, token.value, tokenVar)
+                if jackCall:
+                    jackCall.argCount += \
+                        self.compileExpressionList(jackSubroutine)
+                    self.compileCallEnd(jackSubroutine, jackCall)
+                # If a variable instead
+                elif tokenVar:
+                    self.vmWriter.writePushSymbol(tokenVar)
+        else:
+            self.writeConstantTerm(jackSubroutine, token)
+
+    def writeConstantTerm(self, jackSubroutine, token):
+        if token.type == 'integerConstant':
             self.vmWriter.writeInt(token.value)
+        elif token.type == 'stringConstant' and self.poolStrings:
+            self.writePooledStr(jackSubroutine.jackClass, token.value)
         elif token.type == 'stringConstant':
             self.vmWriter.writeStr(token.value)
         elif token.type == 'keyword':
@@ -333,57 +832,258 @@ class CompilationEngine:
                 if token.value == 'true':
                     self.vmWriter.write('not')
 
-        # In case of a function call or variable name
-        elif token.type == 'identifier':
-            # Save token value as symbol and function in case of both
-            tokenValue = token.value
-            tokenVar = jackSubroutine.getSymbol(tokenValue)
+    def writePooledStr(self, jackClass, string):
+        # The literals of the class are kept in a table, allocated by
+        # Class.$strings the first time one of them is evaluated, and each
+        # literal is built into it the first time it is. The table takes a
+        # single static, as statics are scarce
+        table = jackClass.getSymbol(STRING_TABLE)
+        if table is None:
+            jackClass.addStatic(STRING_TABLE, 'Array')
+            table = jackClass.getSymbol(STRING_TABLE)
+        offset = jackClass.addString(string)
+
+        tableLabel = self.getLabel()
+        builtLabel = self.getLabel()
+        self.vmWriter.writePushSymbol(table)
+        self.vmWriter.writeIfTrue(tableLabel)
+        self.vmWriter.writeCall(jackClass.name, STRING_TABLE, 0)
+        self.vmWriter.writePop('temp', 0)
+        self.vmWriter.writeLabel(tableLabel)
+
+        self.vmWriter.writePushSymbol(table)
+        self.vmWriter.writePop('pointer', 1)
+        self.vmWriter.writePush('that', offset)
+        self.vmWriter.writeIfTrue(builtLabel)
+        self.vmWriter.writeStr(string)
+        self.vmWriter.writePushSymbol(table)
+        self.vmWriter.writePop('pointer', 1)
+        self.vmWriter.writePop('that', offset)
+        # Both ways, pointer 1 is left at the table
+        self.vmWriter.writeLabel(builtLabel)
+        self.vmWriter.writePush('that', offset)
+
+    def writeStringTable(self, jackClass):
+        # function Class.$strings, allocating the table of the literals of
+        # the class, cleared as none of them is built yet
+        table = jackClass.getSymbol(STRING_TABLE)
+        self.vmWriter.write('function {}.{} 0'.format(jackClass.name,
+                                                      STRING_TABLE))
+        self.vmWriter.writeInt(len(jackClass.strings))
+        self.vmWriter.writeCall('Array', 'new', 1)
+        self.vmWriter.writePopSymbol(table)
+        self.vmWriter.writePushSymbol(table)
+        self.vmWriter.writePop('pointer', 1)
+        for offset in range(len(jackClass.strings)):
+            self.vmWriter.writeInt(0)
+            self.vmWriter.writePop('that', offset)
+        self.vmWriter.writeInt(0)
+        self.vmWriter.writeReturn()
 
-            token = self.tokenizer.curToken()
-            if token.value == '[':  # Array
-                self.tokenizer.advance()  # [
-                self.compileExpression(jackSubroutine)
-                self.vmWriter.writePushSymbol(tokenVar)
-                self.vmWriter.write('add')
-                # rebase 'that' to point to var+index
-                self.vmWriter.writePop('pointer', 1)
-                self.vmWriter.writePush('that', 0)
-                self.tokenizer.advance()  # ]
+    def writeArrayRead(self, jackSymbol, index):
+        # The index compiled from index is on the stack
+        if self.optimize:
+            offset = self.writeArrayBase(jackSymbol, index)
+            self.vmWriter.writePush('that', offset)
+            return
+
+        # Add the base to the index
+        self.vmWriter.writePushSymbol(jackSymbol)
+        self.vmWriter.write('add')
+        # rebase 'that' to point to var+index
+        self.vmWriter.writePop('pointer', 1)
+        self.vmWriter.writePush('that', 0)
+
+    def removeCode(self, start, end=None):
+        # Drop buffered instructions. Removing any before the array base in
+        # pointer 1 moves or drops the pop that set it, so it's forgotten
+        if start < 0:
+            start += self.vmWriter.mark()
+        if self.thatBase and start < self.thatBase[1]:
+            self.thatBase = None
+        self.vmWriter.remove(start, end)
+
+    def writeArrayBase(self, jackSymbol, index):
+        # Point 'that' at an element from the index compiled from index,
+        # returning the element's offset from there. A constant index is the
+        # offset itself, and a base still in pointer 1 is reused, as long as
+        # nothing could have changed pointer 1 or memory since it was set
+        offset = self.vmWriter.constantAt(index)
+        if offset is not None and offset >= 0:
+            self.removeCode(index)
+            key = (jackSymbol, ())
+        else:
+            offset = 0
+            key = (jackSymbol, tuple(self.vmWriter.instructions[index:]))
+
+        if self.thatBase and self.thatBase[0] == key \
+                and self.vmWriter.isPure(index) \
+                and self.vmWriter.isReadOnly(self.thatBase[1], index):
+            self.removeCode(index)
+            return offset
+
+        self.vmWriter.writePushSymbol(jackSymbol)
+        if key[1]:
+            self.vmWriter.write('add')
+        self.vmWriter.writePop('pointer', 1)
+        self.thatBase = (key, self.vmWriter.mark())
+        return offset
+
+    def callsAhead(self):
+        # Whether the rest of the statement, up to its ';', could compile to
+        # a call: subroutine calls, but also strings, '*' and '/'
+        k = 0
+        token = self.tokenizer.peek(k)
+        while token is not None and token != ('symbol', ';'):
+            if token.type == 'stringConstant' or token.value in '.*/':
+                return True
+            k += 1
+            nextToken = self.tokenizer.peek(k)
+            if token.type == 'identifier' and nextToken == ('symbol', '('):
+                return True
+            token = nextToken
+
+        return False
+
+    def compileCallStart(self, jackSubroutine, tokenValue, tokenVar):
+        # Compile a call up to its arguments, returning it as a JackCall
+        # once past the '(', or None if the identifier isn't called
+
+        # Default class for function calls is this class
+        funcName = tokenValue
+        funcClass = jackSubroutine.jackClass.name
+        # Used to mark whether to use the default call, a method one
+        defaultCall = True
+        isMethodCall = False
+        argCount = 0
+
+        token = self.tokenizer.curToken()
+        if token.value == '.':
+            defaultCall = False
+            self.tokenizer.advance()  # .
+            funcName = self.tokenizer.advance().value  # function name
+            # If this is an object, call as method
+            if tokenVar:
+                funcClass = tokenVar.type  # Use the class of the object
+                isMethodCall = True
+                argCount = 1  # Add 'this' to args
+                self.vmWriter.writePushSymbol(tokenVar)  # push "this"
             else:
-                # Default class for function calls is this class
-                funcName = tokenValue
-                funcClass = jackSubroutine.jackClass.name
-                # Used to mark whether to use the default call, a method one
-                defaultCall = True
-                argCount = 0
-
-                if token.value == '.':
-                    defaultCall = False
-                    self.tokenizer.advance()  # .
-                    # try to load the object of the method
-                    funcObj = jackSubroutine.getSymbol(tokenValue)
-                    funcName = self.tokenizer.advance().value  # function name
-                    # If this is an object, call as method
-                    if funcObj:
-                        funcClass = tokenVar.type  # Use the class of the object
-                        argCount = 1  # Add 'this' to args
-                        self.vmWriter.writePushSymbol(
-                            tokenVar)  # push "this"
-                    else:
-                        funcClass = tokenValue
-                    token = self.tokenizer.curToken()
-
-                # If in-fact a function call
-                if token.value == '(':
-                    if defaultCall:
-                        # Default call is a method one, push this
-                        argCount = 1
-                        self.vmWriter.writePush('pointer', 0)
-
-                    self.tokenizer.advance()  # (
-                    argCount += self.compileExpressionList(jackSubroutine)
-                    self.vmWriter.writeCall(funcClass, funcName, argCount)
-                    self.tokenizer.advance()  # )
-                # If a variable instead
+                funcClass = tokenValue
+            token = self.tokenizer.curToken()
+
+        # If a variable instead
+        if token.value != '(':
+            return None
+
+        signature = None
+        if self.index:
+            signature = self.index.lookup(funcClass, funcName)
+        # Default call is a method one, push this, unless the index knows
+        # it's a function or constructor of the class
+        if defaultCall and (signature is None or signature.kind == 'method'):
+            isMethodCall = True
+            argCount = 1
+            self.vmWriter.writePush('pointer', 0)
+
+        callToken = self.tokenizer.advance()  # (
+        return CompilationTypes.JackCall(funcClass, funcName, defaultCall,
+                                         isMethodCall, argCount, callToken)
+
+    def compileCallEnd(self, jackSubroutine, jackCall):
+        # The arguments were compiled and counted, the ')' is next
+        self.vmWriter.writeCall(
+            jackCall.className, jackCall.name, jackCall.argCount)
+        self.tokenizer.advance()  # )
+
+        if self.index:
+            self.checkCall(jackSubroutine, jackCall)
+
+    def compileExpressionIterative(self, jackSubroutine):
+        # The same code as the recursive compileExpression and compileTerm,
+        # but the constructs still open are kept on an explicit stack, so
+        # expressions can nest as deep as they like. Each frame is a tuple
+        # tagged with its kind:
+        #   ('expression', start)                  operands so far from start
+        #   ('binary', op, start, operand)         waiting for a right operand
+        #   ('unary', op, operand)                 waiting for its operand
+        #   ('paren',), ('index', jackSymbol), ('call', jackCall)
+        #                                          waiting for an expression
+        advance = self.tokenizer.advance
+        curToken = self.tokenizer.curToken
+        mark = self.vmWriter.mark
+
+        frames = [('expression', mark())]
+        while frames:
+            # Compile a term, or open the frames its operands go in
+            token = advance()
+            if token.value in unaryOpActions:
+                frames.append(('unary', token.value, mark()))
+                continue
+            elif token.value == '(':
+                frames.append(('paren',))
+                frames.append(('expression', mark()))
+                continue
+            elif token.type == 'identifier':
+                tokenVar = jackSubroutine.readSymbol(token.value)
+
+                if curToken().value == '[':  # Array
+                    advance()  # [
+                    frames.append(('index', tokenVar))
+                    frames.append(('expression', mark()))
+                    continue
+
+                jackCall = self.compileCallStart(
+                    jackSubroutine, token.value, tokenVar)
+                if jackCall and curToken() != ('symbol', ')'):
+                    frames.append(('call', jackCall))
+                    frames.append(('expression', mark()))
+                    continue
+                elif jackCall:
+                    self.compileCallEnd(jackSubroutine, jackCall)
                 elif tokenVar:
                     self.vmWriter.writePushSymbol(tokenVar)
+            else:
+                self.writeConstantTerm(jackSubroutine, token)
+
+            # A term is complete, close every frame it completes
+            while frames:
+                frame = frames[-1]
+                if frame[0] == 'unary':
+                    frames.pop()
+                    self.writeUnaryOp(frame[1], frame[2])
+                    continue
+                elif frame[0] == 'binary':
+                    frames.pop()
+                    self.writeBinaryOp(frame[1], frame[2], frame[3])
+                    continue
+
+                # An expression, that goes on if an operator follows
+                token = curToken()
+                if token.value in '+-*/&|<>=':
+                    binaryOp = advance().value
+                    frames.append(('binary', binaryOp, frame[1], mark()))
+                    break
+
+                expression = frames.pop()
+                if not frames:
+                    break
+
+                frame = frames[-1]
+                if frame[0] == 'paren':
+                    frames.pop()
+                    advance()  # )
+                elif frame[0] == 'index':
+                    frames.pop()
+                    self.writeArrayRead(frame[1], expression[1])
+                    advance()  # ]
+                else:
+                    jackCall = frame[1]
+                    jackCall.argCount += 1
+                    if curToken() == ('symbol', ','):
+                        advance()  # ,
+                        frames.append(('expression', mark()))
+                        break
+
+                    frames.pop()
+                    self.compileCallEnd(jackSubroutine, jackCall)
@@ -1,31 +1,81 @@
-from collections import namedtuple
+# The VM segment of the symbols of each kind
+kindToSegment = {'static': 'static',
+				 'field': 'this',
+				 'arg': 'argument',
+				 'var': 'local'}
 
-JackSymbol = namedtuple('Symbol', ['kind', 'type', 'id'])
+
+class JackSymbol:
+
+	# A variable, resolved when it's declared to the segment and offset it's
+	# pushed and popped with. reads and writes count the references to it in
+	# the source, and line is where it's declared, for the unused variable
+	# reports
+	__slots__ = ('name', 'kind', 'type', 'id', 'segment', 'offset', 'reads',
+				 'writes', 'line')
+
+	def __init__(self, name, kind, varType, symbolId, line=None):
+		self.name = name
+		self.kind = kind
+		self.type = varType
+		self.id = symbolId
+		self.segment = kindToSegment[kind]
+		self.offset = str(symbolId)
+		self.reads = 0
+		self.writes = 0
+		self.line = line
+
+
+def unusedSymbols(symbols):
+	# The symbols declared in the source that are never read, whether or not
+	# they're assigned. Names starting with '$' are the compiler's own
+	return [symbol for symbol in symbols.values()
+			if not symbol.reads and symbol.line is not None
+			and not symbol.name.startswith('$')]
 
 
 class JackClass:
 
+	__slots__ = ('name', 'symbols', 'staticSymbols', 'fieldSymbols',
+				 'strings')
+
 	def __init__(self, name):
 		self.name = name
 		self.symbols = dict()
 
 		self.staticSymbols = 0
 		self.fieldSymbols = 0
+		# {string literal: offset in the table}, when literals are pooled
+		self.strings = dict()
 
-	def addField(self, name, varType):
-		self.symbols[name] = JackSymbol('field', varType, self.fieldSymbols)
+	def addField(self, name, varType, line=None):
+		self.symbols[name] = JackSymbol(name, 'field', varType,
+										self.fieldSymbols, line)
 		self.fieldSymbols += 1
 
-	def addStatic(self, name, varType):
-		self.symbols[name] = JackSymbol('static', varType, self.staticSymbols)
+	def addStatic(self, name, varType, line=None):
+		self.symbols[name] = JackSymbol(name, 'static', varType,
+										self.staticSymbols, line)
 		self.staticSymbols += 1
 
 	def getSymbol(self, name):
 		return self.symbols.get(name)
 
+	def addString(self, string):
+		# The offset of a literal in the table, identical literals sharing it
+		if string not in self.strings:
+			self.strings[string] = len(self.strings)
+		return self.strings[string]
+
+	def unusedSymbols(self):
+		return unusedSymbols(self.symbols)
+
 
 class JackSubroutine:
 
+	__slots__ = ('name', 'jackClass', 'subroutineType', 'returnType',
+				 'symbols', 'resolved', 'argSymbols', 'varSymbols')
+
 	def __init__(self, name, subroutineType, returnType, jackClass):
 		self.name = name
 		self.jackClass = jackClass
@@ -33,23 +83,97 @@ class JackSubroutine:
 		self.returnType = returnType
 
 		self.symbols = dict()
+		# {name: symbol or None} of every name looked up, so each is only
+		# resolved once, through this table and then the class's
+		self.resolved = dict()
 		self.argSymbols = 0
 		self.varSymbols = 0
 
 		if subroutineType == 'method':
 			self.addArg('this', self.jackClass.name)
 
-	def addArg(self, name, varType):
-		self.symbols[name] = JackSymbol('arg', varType, self.argSymbols)
+	def addArg(self, name, varType, line=None):
+		self.symbols[name] = JackSymbol(name, 'arg', varType, self.argSymbols,
+										line)
+		self.resolved.pop(name, None)
 		self.argSymbols += 1
 
-	def addVar(self, name, varType):
-		self.symbols[name] = JackSymbol('var', varType, self.varSymbols)
+	def addVar(self, name, varType, line=None):
+		self.symbols[name] = JackSymbol(name, 'var', varType, self.varSymbols,
+										line)
+		self.resolved.pop(name, None)
 		self.varSymbols += 1
 
 	def getSymbol(self, name):
-		symbol = self.symbols.get(name)
-		if symbol:
+		# Names that aren't variables, such as class names, resolve to None
+		try:
+			return self.resolved[name]
+		except KeyError:
+			symbol = self.symbols.get(name) or self.jackClass.getSymbol(name)
+			self.resolved[name] = symbol
 			return symbol
 
-		return self.jackClass.getSymbol(name)
+	def readSymbol(self, name):
+		# Look up a variable the source reads, counting the read
+		symbol = self.getSymbol(name)
+		if symbol is not None:
+			symbol.reads += 1
+		return symbol
+
+	def writeSymbol(self, name):
+		# Look up a variable the source assigns, counting the write
+		symbol = self.getSymbol(name)
+		if symbol is not None:
+			symbol.writes += 1
+		return symbol
+
+	def unusedSymbols(self):
+		return unusedSymbols(self.symbols)
+
+	def release(self):
+		# Once the subroutine is written, only its counts are still needed
+		self.symbols = None
+		self.resolved = None
+
+
+class JackCall:
+
+	# A subroutine call being compiled, argCount counting 'this' if pushed
+	__slots__ = ('className', 'name', 'defaultCall', 'isMethodCall',
+				 'argCount', 'token')
+
+	def __init__(self, className, name, defaultCall, isMethodCall, argCount,
+				 token):
+		self.className = className
+		self.name = name
+		self.defaultCall = defaultCall
+		self.isMethodCall = isMethodCall
+		self.argCount = argCount
+		# The '(' opening the arguments, to report problems at
+		self.token = token
+
+
+class JackError(Exception):
+
+	# An error compiling Jack code, fileName being set once it's known
+	def __init__(self, message, fileName=None):
+		super().__init__(message)
+		self.message = message
+		self.fileName = fileName
+
+	def __str__(self):
+		if self.fileName:
+			return '{}: {}'.format(self.fileName, self.message)
+		return self.message
+
+
+class JackSyntaxError(JackError):
+
+	# Source that can't be tokenized or parsed, at a line and column counted
+	# from 1, if known
+	def __init__(self, message, line=None, column=None, fileName=None):
+		if line is not None:
+			message = '{} at line {}, column {}'.format(message, line, column)
+		super().__init__(message, fileName)
+		self.line = line
+		self.column = column
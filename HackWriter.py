@@ -0,0 +1,213 @@
+from VMWriter import VMWriter
+
+# Hack assembly straight from the buffered VM commands, without writing and
+# parsing VM text in between. Calls, returns and comparisons jump to shared
+# stubs instead of repeating their code at every site, so a program is the
+# bootstrap, the code of its classes, then the stubs, in a single .asm file.
+# shiftleft and shiftright use the shift instructions of the extended ALU
+
+SEGMENT_BASES = {'local': 'LCL', 'argument': 'ARG',
+                 'this': 'THIS', 'that': 'THAT'}
+TEMP_BASE = 5
+# Above this offset, popping into a based segment goes through R13
+POP_UNROLL = 6
+
+PUSH_D = ['@SP', 'AM=M+1', 'A=A-1', 'M=D']
+POP_D = ['@SP', 'AM=M-1', 'D=M']
+
+BINARY = {'add': 'M=D+M', 'sub': 'M=M-D', 'and': 'M=D&M', 'or': 'M=D|M'}
+UNARY = {'neg': 'M=-M', 'not': 'M=!M', 'shiftleft': 'M=M<<',
+         'shiftright': 'M=M>>'}
+COMPARISONS = {'eq': '$$EQ', 'gt': '$$GT', 'lt': '$$LT'}
+
+
+def parseVM(source):
+    # The (opcode, arg1, arg2) commands of VM text, as VMWriter buffers them
+    instructions = []
+    for line in source.splitlines():
+        words = line.split('//', 1)[0].split()
+        if words:
+            words += [None] * (3 - len(words))
+            instructions.append(tuple(words[:3]))
+
+    return instructions
+
+
+def pushSymbol(symbol):
+    # Push the value of a register or variable
+    return ['@' + symbol, 'D=M'] + PUSH_D
+
+
+def callCode(function, argCount, returnLabel):
+    # $$CALL takes the callee in R13, the argument count in R14 and the
+    # return address in D
+    if argCount in (0, 1):
+        code = ['@R14', 'M={}'.format(argCount)]
+    else:
+        code = ['@{}'.format(argCount), 'D=A', '@R14', 'M=D']
+
+    return code + ['@' + function, 'D=A', '@R13', 'M=D',
+                   '@' + returnLabel, 'D=A', '@$$CALL', '0;JMP',
+                   '({})'.format(returnLabel)]
+
+
+def bootstrap():
+    # Set up the stack and call Sys.init, which never returns
+    code = ['@256', 'D=A', '@SP', 'M=D']
+    code += callCode('Sys.init', 0, '$$BOOT')
+    code += ['@$$BOOT', '0;JMP']
+    return '\n'.join(code) + '\n'
+
+
+def comparisonStub(name, jump):
+    # x and y are compared by their signs first, as x - y can overflow
+    xNegative = 'TRUE' if name == 'LT' else 'FALSE'
+    xPositive = 'FALSE' if name == 'LT' else 'TRUE'
+    return ['($${})'.format(name), '@R15', 'M=D',
+            '@SP', 'AM=M-1', 'D=M', '@R13', 'M=D',  # y
+            '@SP', 'A=M-1', 'D=M',  # x
+            '@$${}.XNEG'.format(name), 'D;JLT',
+            '@R13', 'D=M', '@$${}.SUB'.format(name), 'D;JGE',
+            '@$$' + xPositive, '0;JMP',
+            '($${}.XNEG)'.format(name),
+            '@R13', 'D=M', '@$$' + xNegative, 'D;JGE',
+            '($${}.SUB)'.format(name),
+            '@R13', 'D=M', '@SP', 'A=M-1', 'D=M-D',
+            '@$$TRUE', 'D;' + jump,
+            '@$$FALSE', '0;JMP']
+
+
+def stubs():
+    code = ['($$CALL)'] + PUSH_D
+    for register in ('LCL', 'ARG', 'THIS', 'THAT'):
+        code += pushSymbol(register)
+    code += ['@R14', 'D=M', '@5', 'D=D+A', '@SP', 'D=M-D', '@ARG', 'M=D',
+             '@SP', 'D=M', '@LCL', 'M=D',
+             '@R13', 'A=M', '0;JMP']
+
+    # The frame is kept in R13 and the return address in R14
+    code += ['($$RETURN)',
+             '@LCL', 'D=M', '@R13', 'M=D',
+             '@5', 'A=D-A', 'D=M', '@R14', 'M=D']
+    code += POP_D + ['@ARG', 'A=M', 'M=D',
+                     '@ARG', 'D=M+1', '@SP', 'M=D']
+    for register in ('THAT', 'THIS', 'ARG', 'LCL'):
+        code += ['@R13', 'AM=M-1', 'D=M', '@' + register, 'M=D']
+    code += ['@R14', 'A=M', '0;JMP']
+
+    # Comparisons take the return address in D
+    code += ['($$EQ)', '@R15', 'M=D'] + POP_D + \
+            ['A=A-1', 'D=M-D', '@$$TRUE', 'D;JEQ', '@$$FALSE', '0;JMP']
+    code += comparisonStub('GT', 'JGT')
+    code += comparisonStub('LT', 'JLT')
+    code += ['($$TRUE)', '@SP', 'A=M-1', 'M=-1', '@R15', 'A=M', '0;JMP',
+             '($$FALSE)', '@SP', 'A=M-1', 'M=0', '@R15', 'A=M', '0;JMP']
+
+    return '\n'.join(code) + '\n'
+
+
+class HackWriter(VMWriter):
+
+    # The same interface as VMWriter, only rendering assembly when flushing.
+    # Labels are scoped to their function, and statics are named after the
+    # class of the function they're in, unless a file name is given
+    def __init__(self, oStream, chunkSize=None, optimizer=None,
+                 fileName=None):
+        super().__init__(oStream, chunkSize, optimizer)
+        self.fileName = fileName
+        self.function = None
+        self.staticPrefix = fileName
+        self.returnCount = 0
+
+    def render(self, instructions):
+        code = []
+        for opcode, arg1, arg2 in instructions:
+            code += self.translate(opcode, arg1, arg2)
+        return '\n'.join(code) + '\n'
+
+    def translateVM(self, source):
+        # Translate the VM text of a whole file
+        self.instructions.extend(parseVM(source))
+        self.flush()
+
+    def returnLabel(self):
+        label = '{}$ret.{}'.format(self.function, self.returnCount)
+        self.returnCount += 1
+        return label
+
+    def address(self, segment, offset):
+        # The symbol of a fixed address segment entry
+        if segment == 'temp':
+            return 'R{}'.format(TEMP_BASE + int(offset))
+        elif segment == 'pointer':
+            return 'THAT' if offset == '1' else 'THIS'
+        return '{}.{}'.format(self.staticPrefix, offset)
+
+    def translate(self, opcode, arg1, arg2):
+        if opcode == 'push':
+            return self.translatePush(arg1, arg2) + PUSH_D
+        elif opcode == 'pop':
+            return self.translatePop(arg1, arg2)
+        elif opcode in BINARY:
+            return POP_D + ['A=A-1', BINARY[opcode]]
+        elif opcode in UNARY:
+            return ['@SP', 'A=M-1', UNARY[opcode]]
+        elif opcode in COMPARISONS:
+            label = self.returnLabel()
+            return ['@' + label, 'D=A', '@' + COMPARISONS[opcode], '0;JMP',
+                    '({})'.format(label)]
+        elif opcode == 'label':
+            return ['({}${})'.format(self.function, arg1)]
+        elif opcode == 'goto':
+            return ['@{}${}'.format(self.function, arg1), '0;JMP']
+        elif opcode == 'if-goto':
+            return POP_D + ['@{}${}'.format(self.function, arg1), 'D;JNE']
+        elif opcode == 'function':
+            return self.translateFunction(arg1, int(arg2))
+        elif opcode == 'call':
+            return callCode(arg1, int(arg2), self.returnLabel())
+        elif opcode == 'return':
+            return ['@$$RETURN', '0;JMP']
+
+        raise ValueError('unknown VM command {}'.format(opcode))
+
+    def translatePush(self, segment, offset):
+        # Code leaving the value to push in D
+        if segment == 'constant':
+            return ['@' + offset, 'D=A']
+        elif segment in SEGMENT_BASES:
+            base = '@' + SEGMENT_BASES[segment]
+            if offset == '0':
+                return [base, 'A=M', 'D=M']
+            elif offset == '1':
+                return [base, 'A=M+1', 'D=M']
+            return ['@' + offset, 'D=A', base, 'A=D+M', 'D=M']
+
+        return ['@' + self.address(segment, offset), 'D=M']
+
+    def translatePop(self, segment, offset):
+        if segment not in SEGMENT_BASES:
+            return POP_D + ['@' + self.address(segment, offset), 'M=D']
+
+        base = '@' + SEGMENT_BASES[segment]
+        n = int(offset)
+        if n <= POP_UNROLL:
+            return POP_D + [base, 'A=M'] + ['A=A+1'] * n + ['M=D']
+        return ['@' + offset, 'D=A', base, 'D=D+M', '@R13', 'M=D'] + \
+            POP_D + ['@R13', 'A=M', 'M=D']
+
+    def translateFunction(self, name, localCount):
+        self.function = name
+        self.returnCount = 0
+        if not self.fileName:
+            self.staticPrefix = name.split('.')[0]
+
+        code = ['({})'.format(name)]
+        if localCount:
+            # Clear the locals in place, then move the stack pointer once
+            code += ['@SP', 'A=M']
+            for i in range(localCount):
+                code += ['M=0', 'A=A+1'] if i < localCount - 1 else ['M=0']
+            code += ['D=A+1', '@SP', 'M=D']
+
+        return code
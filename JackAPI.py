@@ -0,0 +1,130 @@
+import io
+import os
+import tarfile
+from collections import namedtuple
+from JackTokenizer import JackTokenizer
+from CompilationEngine import CompilationEngine
+from CompilationTypes import JackError, JackSyntaxError
+
+# Compiling in memory, for services that embed the compiler instead of
+# running it once per file. Every call has its own tokenizer and engine and
+# nothing is shared between them, so calls can be made repeatedly and from
+# any number of threads. Problems are raised as JackError, never exiting or
+# printing
+
+# What the engine raises when the source doesn't follow the grammar
+PARSE_ERRORS = (IndexError, AttributeError, TypeError, KeyError, ValueError,
+                RecursionError)
+
+# {VM file name: VM code} of the classes of a project that compiled,
+# {source file name: JackError} of those that didn't, and the warnings of
+# them all
+ProjectResult = namedtuple('ProjectResult', ['files', 'errors', 'warnings'])
+
+
+def vmName(fileName):
+    return os.path.splitext(fileName)[0] + '.vm'
+
+
+def compileString(source, options=None, fileName=None, warnings=None):
+    # The VM code of the source of a class. Its warnings are added to the
+    # warnings list if given
+    tokenizer = None
+    output = io.StringIO()
+    try:
+        tokenizer = JackTokenizer(source)
+        compiler = CompilationEngine(tokenizer, output, printWarnings=False,
+                                     **(options or {}))
+        compiler.compileClass()
+    except JackError as e:
+        e.fileName = e.fileName or fileName
+        raise
+    except PARSE_ERRORS as e:
+        # The engine doesn't check the grammar, it fails further on
+        token = tokenizer.curToken() if tokenizer else None
+        if token is None:
+            raise JackSyntaxError('unexpected end of file',
+                                  fileName=fileName) from e
+        raise JackSyntaxError('syntax error near {}'.format(token.value),
+                              token.line, token.column, fileName) from e
+
+    if warnings is not None:
+        warnings.extend(compiler.warnings)
+    return output.getvalue()
+
+
+def compileSources(sources, options=None):
+    # Compile {file name: source} as a project, into a ProjectResult. A
+    # class that doesn't compile doesn't stop the others
+    files = dict()
+    errors = dict()
+    warnings = []
+    for fileName in sorted(sources):
+        try:
+            files[vmName(fileName)] = compileString(
+                sources[fileName], options, fileName, warnings)
+        except JackError as e:
+            errors[fileName] = e
+
+    return ProjectResult(files, errors, warnings)
+
+
+def compileBatch(projects, options=None):
+    # Compile (project name, {file name: source}) pairs one after the other,
+    # such as those read from a manifest or an archive, yielding (project
+    # name, ProjectResult) pairs. Only one project is held at a time
+    for name, sources in projects:
+        yield name, compileSources(sources, options)
+
+
+def readDirectory(dirPath):
+    # {file name: source} of the classes of a directory. Undecodable bytes
+    # make a syntax error of their class, not of the whole batch
+    sources = dict()
+    for fileName in sorted(os.listdir(dirPath)):
+        fp = os.path.join(dirPath, fileName)
+        if os.path.isfile(fp) and fileName.lower().endswith('.jack'):
+            with open(fp, 'r', encoding='utf-8',
+                      errors='replace') as inputFile:
+                sources[fileName] = inputFile.read()
+
+    return sources
+
+
+def readManifest(manifestPath):
+    # The projects of a manifest, a directory per line, relative to the
+    # manifest. Blank lines and lines starting with '#' are skipped
+    baseDir = os.path.dirname(os.path.abspath(manifestPath))
+    with open(manifestPath, 'r', encoding='utf-8') as manifest:
+        lines = [line.strip() for line in manifest]
+
+    for line in lines:
+        if line and not line.startswith('#'):
+            yield line, readDirectory(os.path.join(baseDir, line))
+
+
+def readArchive(archivePath):
+    # The projects of a tar archive, compressed or not, one per directory
+    # holding .jack files, in the order they first appear. Sources are read
+    # from the archive as they're needed, nothing is extracted
+    with tarfile.open(archivePath, 'r:*') as archive:
+        projects = dict()  # {directory: [member]}
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith('.jack'):
+                dirName, _ = os.path.split(member.name)
+                projects.setdefault(dirName, []).append(member)
+
+        for dirName, members in projects.items():
+            sources = dict()
+            for member in members:
+                data = archive.extractfile(member).read()
+                sources[os.path.basename(member.name)] = data.decode(
+                    'utf-8', errors='replace')
+            yield dirName or '.', sources
+
+
+def readProjects(path):
+    # The projects of a manifest or of a tar archive
+    if tarfile.is_tarfile(path):
+        return readArchive(path)
+    return readManifest(path)
@@ -1,45 +1,483 @@
+import argparse
+import contextlib
+import io
 import sys
 import os
-from JackTokenizer import JackTokenizer
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from JackTokenizer import JackTokenizer, JackTokenStream
 from CompilationEngine import CompilationEngine
+from CompilationTypes import JackError
+from BuildCache import BuildCache, hashFile
+from ClassIndex import ClassIndex
+import JackDaemon
+import JackAPI
+import JackProfiler
+import HackWriter
+from JackProgram import JackProgram, ENTRY_POINT, BOOTSTRAP, INLINE_SIZE
+from VMInterpreter import VMInterpreter, VMError, MAX_STEPS, formatStats
 
+# Bump whenever the generated code changes, to invalidate build caches
+COMPILER_VERSION = '1.8'
+# Instructions buffered before a streamed compilation writes them out
+STREAM_CHUNK_SIZE = 4096
 
-def compileFile(fp):
-    with open(fp, 'r') as inputFile:
-        fileName = os.path.basename(fp)
-        fpNoExt, _ = os.path.splitext(fp)
-        fileNameNoExt, _ = os.path.splitext(fileName)
 
-        outputFp = fpNoExt + '.vm'
-        with open(outputFp, 'w') as outputFile:
+def compileFile(fp, options=None, stream=False):
+    fpNoExt, _ = os.path.splitext(fp)
+    with open(fpNoExt + '.vm', 'w') as outputFile:
+        compileTo(fp, outputFile, options, stream)
+
+
+def compileTo(fp, outputFile, options=None, stream=False):
+    options = options or {}
+    if stream:
+        # The source is tokenized as it is parsed, and the code is written
+        # out between functions, so neither is ever held whole in memory
+        tokenizer = JackTokenStream(fp)
+        options = dict(options)
+        options['chunkSize'] = options.get('chunkSize') or STREAM_CHUNK_SIZE
+    else:
+        with open(fp, 'r') as inputFile:
             tokenizer = JackTokenizer(inputFile.read())
-            compiler = CompilationEngine(tokenizer, outputFile)
-            compiler.compileClass()
 
+    compiler = CompilationEngine(tokenizer, outputFile, **options)
+    compiler.compileClass()
+
+
+def compileSource(source, options=None):
+    # Compile the source of a single class, returning its VM code
+    output = io.StringIO()
+    compiler = CompilationEngine(
+        JackTokenizer(source), output, **(options or {}))
+    compiler.compileClass()
+    return output.getvalue()
+
+
+def runCaptured(compile, *args):
+    # Run a compilation, returning a (result, error message) pair instead of
+    # exiting, so one broken class doesn't take down the rest of the build
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(messages):
+            result = compile(*args)
+    except JackError as e:
+        sys.stdout.write(messages.getvalue())
+        return None, 'Error: {}'.format(e)
+    except SystemExit:
+        return None, messages.getvalue().strip() or 'compilation failed'
+    except Exception as e:
+        return None, '{}: {}'.format(type(e).__name__, e)
+
+    # Warnings of a successful compilation are passed on
+    sys.stdout.write(messages.getvalue())
+    return result, None
+
+
+def tryCompileFile(fp, options=None, stream=False):
+    return runCaptured(compileFile, fp, options, stream)[1]
 
-def compileDir(dirPath):
-    for file in os.listdir(dirPath):
+
+def tryCompileSource(source, options=None):
+    return runCaptured(compileSource, source, options)
+
+
+def listSources(dirPath):
+    sources = []
+    for file in sorted(os.listdir(dirPath)):
         fp = os.path.join(dirPath, file)
         _, fileExt = os.path.splitext(fp)
         if os.path.isfile(fp) and fileExt.lower() == '.jack':
-            compileFile(fp)
+            sources.append(fp)
+
+    return sources
+
+
+def listVMSources(dirPath, sources):
+    # The .vm files of a directory that weren't compiled from its sources
+    compiled = {os.path.splitext(fp)[0] for fp in sources}
+    vmSources = []
+    for file in sorted(os.listdir(dirPath)):
+        fp = os.path.join(dirPath, file)
+        fpNoExt, fileExt = os.path.splitext(fp)
+        if os.path.isfile(fp) and fileExt.lower() == '.vm' \
+                and fpNoExt not in compiled:
+            vmSources.append(fp)
+
+    return vmSources
+
+
+def asmPath(inputPath):
+    # A directory is a program, written to a .asm file named after it
+    if os.path.isdir(inputPath):
+        name = os.path.basename(os.path.abspath(inputPath))
+        return os.path.join(inputPath, name + '.asm')
+
+    fpNoExt, _ = os.path.splitext(inputPath)
+    return fpNoExt + '.asm'
+
+
+def compileAsm(inputPath, sources, options=None, stream=False):
+    # Compile straight to Hack assembly, into a single file. A directory
+    # gets the bootstrap code, and its .vm files without a Jack source, such
+    # as the OS, are translated along
+    options = dict(options or {}, target='asm')
+    isDir = os.path.isdir(inputPath)
+    jackSources = [fp for fp in sources if fp.lower().endswith('.jack')]
+    vmSources = [fp for fp in sources if fp.lower().endswith('.vm')]
+    if isDir:
+        vmSources = listVMSources(inputPath, jackSources)
+
+    outputFp = asmPath(inputPath)
+    failed = 0
+    with open(outputFp, 'w') as outputFile:
+        if isDir:
+            outputFile.write(HackWriter.bootstrap())
+
+        for fp in jackSources:
+            # Buffered per class, so a broken one leaves nothing behind
+            code = io.StringIO()
+            _, error = runCaptured(compileTo, fp, code, options, stream)
+            if error:
+                print('ERROR: {}: {}'.format(fp, error))
+                failed += 1
+            else:
+                outputFile.write(code.getvalue())
+
+        writer = HackWriter.HackWriter(outputFile)
+        for fp in vmSources:
+            with open(fp, 'r') as inputFile:
+                writer.translateVM(inputFile.read())
+
+        outputFile.write(HackWriter.stubs())
+
+    if failed:
+        os.remove(outputFp)
+    return failed == 0
+
+
+def compileDir(dirPath, jobs=1, incremental=False, force=False, options=None,
+               stream=False):
+    return compileSources(
+        listSources(dirPath), jobs, incremental, force, options, stream)
+
+
+def compileSources(sources, jobs=1, incremental=False, force=False,
+                   options=None, stream=False):
+    # options are passed on to CompilationEngine, and as they change the
+    # generated code, they are part of the build cache settings. Streaming
+    # gives the same code, so it isn't
+    options = options or {}
+    compile = partial(tryCompileFile, options=options, stream=stream)
+
+    cache = None
+    stale = sources
+    if incremental and sources:
+        outputDir = os.path.dirname(sources[0])
+        settings = dict(options)
+        if settings.get('index'):
+            # A changed signature can change the code of any class calling it
+            settings['index'] = settings['index'].fingerprint()
+        cache = BuildCache(outputDir, COMPILER_VERSION, settings)
+        cache.prune(sources)
+
+        hashes = {fp: hashFile(fp) for fp in sources}
+        if not force:
+            stale = [fp for fp in sources if not cache.isValid(fp, hashes[fp])]
+
+    if jobs > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            errors = list(pool.map(compile, stale))
+    else:
+        errors = [compile(fp) for fp in stale]
+
+    failed = 0
+    for fp, error in zip(stale, errors):
+        if error:
+            print('ERROR: {}: {}'.format(fp, error))
+            failed += 1
+            if cache:
+                cache.forget(fp)
+        elif cache:
+            cache.record(fp, hashes[fp])
+
+    if cache:
+        cache.save()
+        print('{} rebuilt, {} cached, {} failed'.format(
+            len(stale) - failed, len(sources) - len(stale), failed))
+
+    return failed == 0
+
+
+def compileBatch(path, options=None):
+    # Compile every project of a manifest or tar archive in this process,
+    # reporting the classes that don't compile. Nothing is written
+    count = 0
+    failed = 0
+    for name, result in JackAPI.compileBatch(JackAPI.readProjects(path),
+                                             options):
+        count += 1
+        failed += bool(result.errors)
+        for fileName, error in sorted(result.errors.items()):
+            print('ERROR: {}: {}'.format(os.path.join(name, fileName),
+                                         error.message))
+
+    print('{} projects compiled, {} failed'.format(count - failed, failed))
+    return failed == 0
+
+
+def cleanSources(sources):
+    if sources:
+        cache = BuildCache(os.path.dirname(sources[0]), COMPILER_VERSION)
+        print('{} outputs removed'.format(cache.clean(sources)))
+        ClassIndex(os.path.dirname(sources[0])).clean()
+
+
+def indexSources(dirPath):
+    # Bring the class index of the directory up to date
+    index = ClassIndex(dirPath)
+    index.update(listSources(dirPath))
+    index.save()
+    return index
+
+
+def loadProgram(sources, options=None, vmSources=()):
+    # Compile the classes together in memory, along with the given .vm
+    # files, or None if any class fails
+    program = JackProgram(options)
+    failed = 0
+    for fp in sources:
+        _, error = runCaptured(program.addFile, fp)
+        if error:
+            print('ERROR: {}: {}'.format(fp, error))
+            failed += 1
+    if failed:
+        return None
+
+    for fp in vmSources:
+        program.addVMFile(fp)
+    return program
+
+
+def reduceProgram(program, entry=ENTRY_POINT, inlineSize=None):
+    # Leave out every subroutine that can't be reached from the entry point,
+    # first inlining small subroutines if an inline size is given
+    if inlineSize:
+        inlined = program.inline(inlineSize)
+        print('Inlined {} call sites of {} subroutines'.format(
+            sum(inlined.values()), len(inlined)))
+        for name, count in sorted(inlined.items()):
+            print('{:>8}  {}'.format(count, name))
+
+    total = program.instructionCount()
+    try:
+        removed = program.eliminateDeadCode(entry)
+    except KeyError as e:
+        print('ERROR: {}'.format(e.args[0]))
+        return False
+
+    print('Removed {} unreachable subroutines, {} of {} instructions'.format(
+        len(removed), sum(removed.values()), total))
+    for name, size in sorted(removed.items()):
+        print('{:>8}  {}'.format(size, name))
+
+    return True
+
+
+def compileProgram(sources, options=None, entry=ENTRY_POINT,
+                   inlineSize=None, asmFp=None, vmSources=()):
+    # Compile the classes as a whole program. With an assembly file, the
+    # program is linked with the given .vm files and written there
+    program = loadProgram(sources, options, vmSources)
+    if program is None or not reduceProgram(program, entry, inlineSize):
+        return False
+
+    if asmFp:
+        program.writeAsm(asmFp)
+    else:
+        program.write()
+    return True
+
+
+def runProgram(sources, options=None, entry=ENTRY_POINT, inlineSize=None,
+               wholeProgram=False, maxSteps=MAX_STEPS, vmSources=()):
+    # Compile the program in memory and interpret it, printing its output
+    # and the instructions executed by every function. It starts from
+    # Sys.init if the program has one, as the OS would
+    program = loadProgram(sources, options, vmSources)
+    if program is None:
+        return False
+    if (wholeProgram or inlineSize) \
+            and not reduceProgram(program, entry, inlineSize):
+        return False
+
+    functions = program.functions()
+    try:
+        interpreter = VMInterpreter(functions, maxSteps)
+        finished = interpreter.run(
+            BOOTSTRAP if BOOTSTRAP in functions else entry)
+    except VMError as e:
+        print('ERROR: {}'.format(e))
+        return False
+
+    if interpreter.output:
+        print(interpreter.output)
+    if not finished:
+        print('Stopped after {} instructions'.format(maxSteps))
+    print(formatStats(interpreter.stats()))
+    return True
+
+
+def profileSources(sources, options, jsonPath=None, cProfilePath=None):
+    # Always a full, sequential build, so every class is measured alike
+    profiles = JackProfiler.profileSources(sources, options)
+    print(JackProfiler.formatTable(profiles))
+
+    if jsonPath:
+        JackProfiler.writeJson(profiles, jsonPath)
+    if cProfilePath:
+        slowest = JackProfiler.dumpSlowest(profiles, options, cProfilePath)
+        if slowest:
+            print('cProfile stats of {} written to {}'.format(
+                slowest, cProfilePath))
+
+    return all('error' not in profile for profile in profiles)
 
 
 def main():
-    if len(sys.argv) < 2:
-        print('USAGE: use JackCompiler <path>'.format(sys.argv[0]))
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        prog='JackCompiler', description='Compile Jack classes to VM code')
+    parser.add_argument('path', nargs='?',
+                        help='a .jack file, or a directory of them')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='compile a directory with N worker processes')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only recompile classes whose output is stale')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild every class, refreshing the build cache')
+    parser.add_argument('--clean', action='store_true',
+                        help='remove the compiled outputs and the build cache')
+    parser.add_argument('-O', '--optimize', action='store_true',
+                        help='run the peephole optimizer over the VM code')
+    parser.add_argument('--stream', action='store_true',
+                        help='tokenize sources lazily, in bounded memory')
+    parser.add_argument('--index', action='store_true',
+                        help='check calls against an index of the classes')
+    parser.add_argument('--iterative', action='store_true',
+                        help='compile expressions without recursion')
+    parser.add_argument('--pool-strings', action='store_true',
+                        help='build each string literal only once')
+    parser.add_argument('--warn-unused', action='store_true',
+                        help='warn about variables that are never used')
+    parser.add_argument('--batch', action='store_true',
+                        help='compile the projects of a manifest or tar '
+                             'archive, reporting those that fail')
+    parser.add_argument('--target', choices=('vm', 'asm'), default='vm',
+                        help='write VM code, or Hack assembly directly')
+    parser.add_argument('--whole-program', action='store_true',
+                        help='drop subroutines unreachable from the entry point')
+    parser.add_argument('--entry', default=ENTRY_POINT, metavar='FUNCTION',
+                        help='the entry point of --whole-program')
+    parser.add_argument('--inline', nargs='?', type=int, const=INLINE_SIZE,
+                        metavar='N', help='inline leaf subroutines of up to N '
+                        'instructions, implies --whole-program')
+    parser.add_argument('--run', action='store_true',
+                        help='interpret the program, counting instructions')
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS,
+                        metavar='N', help='stop --run after N instructions')
+    parser.add_argument('--profile', action='store_true',
+                        help='time the phases of every class compiled')
+    parser.add_argument('--profile-json', metavar='FILE',
+                        help='also write the profile as JSON')
+    parser.add_argument('--profile-cprofile', metavar='FILE',
+                        help='dump cProfile stats of the slowest class')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, recompiling classes as they change')
+    parser.add_argument('--interval', type=float, default=0.5, metavar='SEC',
+                        help='how often --watch polls for changes')
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help='serve compile requests on a local socket')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='the address --serve listens on')
+    args = parser.parse_args()
+
+    options = dict()
+    if args.optimize:
+        options['optimize'] = True
+    if args.iterative:
+        options['iterative'] = True
+    if args.pool_strings:
+        options['poolStrings'] = True
+    if args.warn_unused:
+        options['warnUnused'] = True
+
+    if args.serve is not None:
+        JackDaemon.serve(args.host, args.serve,
+                         partial(tryCompileSource, options=options))
+        return
+    elif args.path is None:
+        parser.error('a path is required')
 
-    inputPath = sys.argv[1]
+    inputPath = args.path
+    incremental = args.incremental or args.force
 
     if os.path.isdir(inputPath):
-        compileDir(inputPath)
+        sources = listSources(inputPath)
     elif os.path.isfile(inputPath):
-        compileFile(inputPath)
+        sources = [inputPath]
     else:
         print("ERROR: Invalid file or directory, compilation failed")
         sys.exit(1)
 
+    if args.batch:
+        if not compileBatch(inputPath, options):
+            sys.exit(1)
+        return
+
+    if args.index and not args.clean:
+        options['index'] = indexSources(
+            inputPath if os.path.isdir(inputPath)
+            else os.path.dirname(inputPath) or '.')
+
+    if args.clean:
+        cleanSources(sources)
+    elif args.profile or args.profile_json or args.profile_cprofile:
+        if not profileSources(sources, options, args.profile_json,
+                              args.profile_cprofile):
+            sys.exit(1)
+    elif args.run:
+        vmSources = []
+        if os.path.isdir(inputPath):
+            vmSources = listVMSources(inputPath, sources)
+        if not runProgram(sources, options, args.entry, args.inline,
+                          args.whole_program, args.max_steps, vmSources):
+            sys.exit(1)
+    elif (args.whole_program or args.inline) and args.target == 'asm':
+        if not os.path.isdir(inputPath):
+            parser.error('--target asm with --whole-program needs a directory')
+        if not compileProgram(sources, options, args.entry, args.inline,
+                              asmPath(inputPath),
+                              listVMSources(inputPath, sources)):
+            sys.exit(1)
+    elif args.whole_program or args.inline:
+        if not compileProgram(sources, options, args.entry, args.inline):
+            sys.exit(1)
+    elif args.target == 'asm':
+        if not compileAsm(inputPath, sources, options, args.stream):
+            sys.exit(1)
+    elif args.watch:
+        JackDaemon.watch(inputPath, partial(tryCompileFile, options=options,
+                                            stream=args.stream),
+                         args.interval)
+    elif os.path.isfile(inputPath) and not incremental:
+        error = tryCompileFile(inputPath, options, args.stream)
+        if error:
+            print(error)
+            sys.exit(1)
+    elif not compileSources(sources, args.jobs, incremental, args.force,
+                            options, args.stream):
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
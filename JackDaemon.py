@@ -0,0 +1,115 @@
+import json
+import os
+import socket
+import socketserver
+import time
+
+
+def sourceStamp(fp):
+    stat = os.stat(fp)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def scanSources(rootPath):
+    # The modification stamp of every Jack source under the root
+    if os.path.isfile(rootPath):
+        paths = [rootPath]
+    else:
+        paths = [os.path.join(dirPath, fileName)
+                 for dirPath, _, fileNames in os.walk(rootPath)
+                 for fileName in fileNames
+                 if fileName.lower().endswith('.jack')]
+
+    stamps = dict()
+    for fp in paths:
+        try:
+            stamps[fp] = sourceStamp(fp)
+        except OSError:  # Removed while scanning
+            continue
+
+    return stamps
+
+
+def isOutdated(fp):
+    fpNoExt, _ = os.path.splitext(fp)
+    try:
+        return os.stat(fpNoExt + '.vm').st_mtime_ns < os.stat(fp).st_mtime_ns
+    except OSError:
+        return True
+
+
+def watch(rootPath, compileFile, interval=0.5):
+    # Poll the tree, recompiling every class whose source changed since the
+    # last scan. compileFile returns an error message, or None on success.
+    # On startup, only classes whose output is missing or older are compiled
+    stamps = {fp: stamp for fp, stamp in scanSources(rootPath).items()
+              if not isOutdated(fp)}
+
+    print('Watching {} (Ctrl-C to stop)'.format(rootPath))
+    try:
+        while True:
+            current = scanSources(rootPath)
+            for fp in sorted(current):
+                if stamps.get(fp) == current[fp]:
+                    continue
+
+                start = time.perf_counter()
+                error = compileFile(fp)
+                elapsed = (time.perf_counter() - start) * 1000
+                print('{}: {} ({:.1f} ms)'.format(
+                    fp, 'ERROR: ' + error if error else 'ok', elapsed))
+
+            stamps = current
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+class CompileHandler(socketserver.StreamRequestHandler):
+
+    # One JSON request per line, {"source": <jack code>}, answered with
+    # {"vm": <vm code>} or {"error": <message>} on a line of its own
+    def handle(self):
+        for line in self.rfile:
+            try:
+                source = json.loads(line)['source']
+            except (ValueError, KeyError, TypeError):
+                reply = {'error': 'malformed request'}
+            else:
+                vm, error = self.server.compileSource(source)
+                reply = {'vm': vm} if error is None else {'error': error}
+
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+            self.wfile.flush()
+
+
+class CompileServer(socketserver.TCPServer):
+
+    allow_reuse_address = True
+
+    # Requests are served one at a time, each compile takes milliseconds
+    def __init__(self, address, compileSource):
+        super().__init__(address, CompileHandler)
+        self.compileSource = compileSource
+
+
+def serve(host, port, compileSource):
+    # compileSource returns a (vm, error) pair for a Jack class source
+    with CompileServer((host, port), compileSource) as server:
+        print('Serving compile requests on {}:{}'.format(
+            *server.server_address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def requestCompile(source, port, host='127.0.0.1'):
+    # Client side of the compile server, returns the (vm, error) pair
+    with socket.create_connection((host, port)) as connection:
+        stream = connection.makefile('rwb')
+        stream.write(json.dumps({'source': source}).encode() + b'\n')
+        stream.flush()
+        reply = json.loads(stream.readline())
+
+    return reply.get('vm'), reply.get('error')
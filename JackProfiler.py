@@ -0,0 +1,152 @@
+import contextlib
+import cProfile
+import io
+import json
+import os
+import time
+import tracemalloc
+from JackTokenizer import JackTokenizer
+from CompilationEngine import CompilationEngine
+from CompilationTypes import JackError
+from VMWriter import formatInstructions
+
+PHASES = ('read', 'tokenize', 'compile', 'write')
+
+
+def compileInMemory(source, options):
+    tokenizer = JackTokenizer(source)
+    compiler = CompilationEngine(tokenizer, None, **options)
+    compiler.compileClass()
+    return tokenizer, compiler
+
+
+def subroutineSizes(instructions):
+    # The number of instructions emitted for every function
+    sizes = dict()
+    name = None
+    for opcode, arg1, _ in instructions:
+        if opcode == 'function':
+            name = arg1
+            sizes[name] = 0
+        elif name:
+            sizes[name] += 1
+
+    return sizes
+
+
+def profileFile(fp, options):
+    # Compile a file as JackCompiler.compileFile does, timing each phase.
+    # Comments are stripped by the lexer, so they are part of tokenize
+    times = dict()
+
+    start = time.perf_counter()
+    with open(fp, 'r') as inputFile:
+        source = inputFile.read()
+    times['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tokenizer = JackTokenizer(source)
+    times['tokenize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compiler = CompilationEngine(tokenizer, None, **options)
+    compiler.compileClass()
+    times['compile'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    instructions = compiler.vmWriter.instructions
+    fpNoExt, _ = os.path.splitext(fp)
+    with open(fpNoExt + '.vm', 'w') as outputFile:
+        outputFile.write(formatInstructions(instructions))
+    times['write'] = time.perf_counter() - start
+
+    # Memory is traced in a second run, tracing would skew the timings
+    tracemalloc.start()
+    compileInMemory(source, options)
+    _, peakMemory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    profile = {'file': fp,
+               'lines': source.count('\n'),
+               'tokens': len(tokenizer.tokens),
+               'instructions': len(instructions),
+               'times': times,
+               'total': sum(times.values()),
+               'peakMemory': peakMemory,
+               'subroutines': subroutineSizes(instructions)}
+
+    optimizer = compiler.vmWriter.optimizer
+    if optimizer:
+        profile['optimizer'] = optimizer.stats()
+
+    return profile
+
+
+def profileSources(sources, options=None):
+    options = options or {}
+    profiles = []
+    for fp in sources:
+        messages = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(messages):
+                profiles.append(profileFile(fp, options))
+        except JackError as e:
+            profiles.append({'file': fp, 'error': 'Error: {}'.format(e)})
+        except (SystemExit, Exception) as e:
+            error = messages.getvalue().strip() or repr(e)
+            profiles.append({'file': fp, 'error': error})
+
+    return profiles
+
+
+def dumpSlowest(profiles, options, outputPath):
+    # Run the slowest file again under cProfile, and dump its stats
+    compiled = [profile for profile in profiles if 'error' not in profile]
+    if not compiled:
+        return None
+
+    slowest = max(compiled, key=lambda profile: profile['total'])
+    with open(slowest['file'], 'r') as inputFile:
+        source = inputFile.read()
+
+    profiler = cProfile.Profile()
+    profiler.runcall(compileInMemory, source, options or {})
+    profiler.dump_stats(outputPath)
+    return slowest['file']
+
+
+def formatTable(profiles, topSubroutines=10):
+    header = '{:<24} {:>7} {:>8} {:>7}' + ' {:>9}' * len(PHASES) + \
+             ' {:>9} {:>9}'
+    row = '{:<24} {:>7} {:>8} {:>7}' + ' {:>9.2f}' * len(PHASES) + \
+          ' {:>9.2f} {:>9.1f}'
+
+    lines = [header.format('file', 'lines', 'tokens', 'instrs',
+                           *(phase + ' ms' for phase in PHASES),
+                           'total ms', 'peak KiB')]
+    subroutines = []
+    for profile in profiles:
+        name = os.path.basename(profile['file'])
+        if 'error' in profile:
+            lines.append('{:<24} ERROR: {}'.format(name, profile['error']))
+            continue
+
+        lines.append(row.format(
+            name, profile['lines'], profile['tokens'], profile['instructions'],
+            *(profile['times'][phase] * 1000 for phase in PHASES),
+            profile['total'] * 1000, profile['peakMemory'] / 1024))
+        subroutines.extend(profile['subroutines'].items())
+
+    if subroutines:
+        subroutines.sort(key=lambda item: -item[1])
+        lines.append('')
+        lines.append('Largest subroutines, in VM instructions:')
+        lines.extend('{:>8}  {}'.format(size, name)
+                     for name, size in subroutines[:topSubroutines])
+
+    return '\n'.join(lines)
+
+
+def writeJson(profiles, outputPath):
+    with open(outputPath, 'w') as outputFile:
+        json.dump(profiles, outputFile, indent=1)
@@ -0,0 +1,323 @@
+import os
+from JackTokenizer import JackTokenizer
+from CompilationEngine import CompilationEngine
+from VMWriter import formatInstructions
+import HackWriter
+
+ENTRY_POINT = 'Main.main'
+# Called by the VM bootstrap, when the project brings its own Sys class
+BOOTSTRAP = 'Sys.init'
+
+# The largest body, in instructions, of a subroutine to inline
+INLINE_SIZE = 8
+# Inlined arguments and locals live in the temp segment
+TEMP_SIZE = 8
+
+METHOD_PROLOGUE = [('push', 'argument', '0'), ('pop', 'pointer', '0')]
+BRANCHES = ('label', 'goto', 'if-goto', 'return', 'call', 'function')
+# Where control flow may join or leave a straight run of instructions
+JUMPS = ('label', 'goto', 'if-goto', 'return', 'function')
+
+
+def scratchAccess(opcode, segment, index):
+    # The temp or pointer 1 slot an instruction reads or writes, if any, as
+    # (slot, isWrite). Pushing or popping that reads pointer 1
+    if segment == 'temp' or (segment, index) == ('pointer', '1'):
+        return (segment, index), opcode == 'pop'
+    elif segment == 'that':
+        return ('pointer', '1'), False
+    return None, False
+
+
+def exposedScratch(instructions):
+    # The scratch slots some straight run of the function reads before it
+    # writes them, and so may expect to hold a value from elsewhere
+    exposed = set()
+    written = set()
+    for instruction in instructions:
+        if instruction[0] in JUMPS:
+            written = set()
+            continue
+        slot, isWrite = scratchAccess(*instruction)
+        if slot is None:
+            continue
+        elif isWrite:
+            written.add(slot)
+        elif slot not in written:
+            exposed.add(slot)
+
+    return exposed
+
+
+def liveScratch(instructions, position, exposed):
+    # The scratch slots that may hold a value still needed after the
+    # instruction at position. The straight run following it is followed
+    # exactly, past it any slot exposed in the function may be read
+    written = set()
+    live = set()
+    for instruction in instructions[position + 1:]:
+        if instruction[0] in JUMPS:
+            return live | (exposed - written)
+        slot, isWrite = scratchAccess(*instruction)
+        if slot is None:
+            continue
+        elif isWrite:
+            written.add(slot)
+        elif slot not in written:
+            live.add(slot)
+
+    return live
+
+
+def splitFunctions(instructions):
+    # {function name: its instructions, starting with the function command}
+    functions = dict()
+    name = None
+    for instruction in instructions:
+        if instruction[0] == 'function':
+            name = instruction[1]
+            functions[name] = []
+        functions[name].append(instruction)
+
+    return functions
+
+
+class InlineTemplate:
+
+    # The body of a small leaf subroutine, and how to expand it in place of
+    # a call to it. The expansion uses pointer 1 and temp: the object of a
+    # method or constructor is put in pointer 1, its fields read through
+    # that, and arguments and locals are kept in temp. It's only used where
+    # the caller keeps nothing in the slots it writes across the call
+    def __init__(self, name, instructions, maxSize):
+        self.name = name
+        self.className = name.split('.')[0]
+        self.localCount = int(instructions[0][2])
+        self.fieldCount = None
+        self.kind = 'function'
+        self.body = None
+
+        body = instructions[1:]
+        if body[:2] == METHOD_PROLOGUE:
+            self.kind = 'method'
+            body = body[2:]
+        elif body[0][:2] == ('push', 'constant') \
+                and body[1:3] == [('call', 'Memory.alloc', '1'),
+                                  ('pop', 'pointer', '0')]:
+            self.kind = 'constructor'
+            self.fieldCount = body[0][2]
+            body = body[3:]
+
+        if not body or body[-1][0] != 'return' or len(body) - 1 > maxSize:
+            return
+        body = body[:-1]
+
+        self.argCount = 0
+        self.usesStatics = False
+        usesObject = self.kind != 'function'
+        for opcode, segment, index in body:
+            if opcode in BRANCHES or segment == 'temp':
+                return
+            elif segment == 'this' and not usesObject:
+                return
+            elif usesObject and (segment == 'that'
+                                 or (segment, index) == ('pointer', '1')):
+                return
+            elif (segment, index) == ('pointer', '0') \
+                    and (not usesObject or opcode == 'pop'):
+                return
+            elif segment == 'argument':
+                self.argCount = max(self.argCount, int(index) + 1)
+            elif segment == 'static':
+                # Statics belong to the file of the class
+                self.usesStatics = True
+
+        self.body = body
+
+    def readLocals(self):
+        # Locals read before being written, that need their initial 0
+        written = set()
+        read = set()
+        for opcode, segment, index in self.body:
+            if segment != 'local':
+                continue
+            elif opcode == 'pop':
+                written.add(index)
+            elif index not in written:
+                read.add(index)
+
+        return read
+
+    def expand(self, callerClass, argCount):
+        # The code replacing a call with argCount arguments, or None if it
+        # can't be inlined there
+        if self.argCount > argCount or argCount + self.localCount > TEMP_SIZE:
+            return None
+        if self.usesStatics and callerClass != self.className:
+            return None
+
+        code = []
+        if self.kind == 'constructor':
+            code += [('push', 'constant', self.fieldCount),
+                     ('call', 'Memory.alloc', '1'),
+                     ('pop', 'pointer', '1')]
+
+        isMethod = self.kind == 'method'
+        for i in reversed(range(1 if isMethod else 0, argCount)):
+            code.append(('pop', 'temp', str(i)))
+        if isMethod:
+            code.append(('pop', 'pointer', '1'))  # 'this' is argument 0
+
+        for index in sorted(self.readLocals()):
+            code += [('push', 'constant', '0'),
+                     ('pop', 'temp', str(argCount + int(index)))]
+
+        for opcode, segment, index in self.body:
+            if segment == 'argument' and isMethod and index == '0':
+                segment, index = 'pointer', '1'
+            elif segment == 'argument':
+                segment = 'temp'
+            elif segment == 'local':
+                segment, index = 'temp', str(argCount + int(index))
+            elif segment == 'this':
+                segment = 'that'
+            elif segment == 'pointer':
+                index = '1'
+            code.append((opcode, segment, index))
+
+        return code
+
+
+class JackProgram:
+
+    # Every class of a project compiled in memory, so the program can be
+    # analysed and transformed as a whole before it is written out
+    def __init__(self, options=None):
+        self.options = options or {}
+        # {source path: {function name: instructions}}, in compile order
+        self.classes = dict()
+
+    def addFile(self, fp):
+        with open(fp, 'r') as inputFile:
+            self.addSource(fp, inputFile.read())
+
+    def addVMFile(self, fp):
+        # An already compiled class, such as one of the OS, to link in
+        with open(fp, 'r') as inputFile:
+            self.classes[fp] = splitFunctions(
+                HackWriter.parseVM(inputFile.read()))
+
+    def addSource(self, fp, source):
+        compiler = CompilationEngine(
+            JackTokenizer(source), None, **self.options)
+        compiler.compileClass()
+        self.classes[fp] = splitFunctions(compiler.vmWriter.instructions)
+
+    def functions(self):
+        return {name: instructions
+                for functions in self.classes.values()
+                for name, instructions in functions.items()}
+
+    def callGraph(self):
+        # {function: functions of the program it calls}, calls to the OS or
+        # to anything else not compiled here are left out
+        functions = self.functions()
+        return {name: {arg1 for opcode, arg1, _ in instructions
+                       if opcode == 'call' and arg1 in functions}
+                for name, instructions in functions.items()}
+
+    def reachable(self, roots):
+        graph = self.callGraph()
+        seen = set()
+        pending = [root for root in roots if root in graph]
+        while pending:
+            name = pending.pop()
+            if name not in seen:
+                seen.add(name)
+                pending.extend(graph[name] - seen)
+
+        return seen
+
+    def inline(self, maxSize=INLINE_SIZE):
+        # Expand calls to small leaf subroutines in place, returns the
+        # number of call sites inlined for every subroutine
+        templates = dict()
+        for name, instructions in self.functions().items():
+            template = InlineTemplate(name, instructions, maxSize)
+            if template.body is not None:
+                templates[name] = template
+
+        inlined = dict()
+        for functions in self.classes.values():
+            for name, instructions in functions.items():
+                callerClass = name.split('.')[0]
+                exposed = exposedScratch(instructions)
+                code = []
+                for position, instruction in enumerate(instructions):
+                    opcode, callee, argCount = instruction
+                    expansion = None
+                    if opcode == 'call' and callee in templates \
+                            and callee != name:
+                        expansion = templates[callee].expand(
+                            callerClass, int(argCount))
+                    if expansion is not None:
+                        # A call never touches the caller's scratch slots,
+                        # the expansion must not either
+                        clobbered = {scratchAccess(*step)[0]
+                                     for step in expansion
+                                     if step[0] == 'pop'}
+                        if clobbered & liveScratch(instructions, position,
+                                                   exposed):
+                            expansion = None
+
+                    if expansion is None:
+                        code.append(instruction)
+                    else:
+                        code += expansion
+                        inlined[callee] = inlined.get(callee, 0) + 1
+
+                functions[name] = code
+
+        return inlined
+
+    def eliminateDeadCode(self, entry=ENTRY_POINT):
+        # Drop every function that can't be reached from the entry point,
+        # returns the removed {function name: instruction count}
+        if entry not in self.functions():
+            raise KeyError('entry point {} is not defined'.format(entry))
+
+        live = self.reachable([entry, BOOTSTRAP])
+        removed = dict()
+        for functions in self.classes.values():
+            for name in list(functions):
+                if name not in live:
+                    removed[name] = len(functions.pop(name))
+
+        return removed
+
+    def instructionCount(self):
+        return sum(len(instructions)
+                   for instructions in self.functions().values())
+
+    def write(self):
+        # Every class is written, even if nothing is left of it, so no
+        # stale output from an earlier build remains
+        for fp, functions in self.classes.items():
+            fpNoExt, _ = os.path.splitext(fp)
+            with open(fpNoExt + '.vm', 'w') as outputFile:
+                outputFile.write(formatInstructions(
+                    instruction for instructions in functions.values()
+                    for instruction in instructions))
+
+    def writeAsm(self, outputFp, bootstrap=True):
+        # The whole program as a single Hack assembly file
+        with open(outputFp, 'w') as outputFile:
+            if bootstrap:
+                outputFile.write(HackWriter.bootstrap())
+            writer = HackWriter.HackWriter(outputFile)
+            writer.instructions.extend(
+                instruction for functions in self.classes.values()
+                for instructions in functions.values()
+                for instruction in instructions)
+            writer.flush()
+            outputFile.write(HackWriter.stubs())
@@ -1,64 +1,332 @@
+import codecs
+import mmap
+import os
 import re
-import sys
+from array import array
+from bisect import bisect_right
 from collections import namedtuple
+from CompilationTypes import JackSyntaxError
 
-Token = namedtuple('Token', ('type', 'value'))
+
+class Token(namedtuple('Token', ('type', 'value', 'line', 'column'))):
+
+    # The position is part of the tuple, so tokens need no __dict__, but
+    # it's left out of comparisons: tokens still compare equal to plain
+    # (type, value) pairs
+    __slots__ = ()
+
+    def __new__(cls, type, value, line=0, column=0):
+        return super().__new__(cls, type, value, line, column)
+
+    def __eq__(self, other):
+        if isinstance(other, Token):
+            other = other[:2]
+        return self[:2] == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self[:2])
+
+
+# Token types by their compact code in a TokenTable
+TOKEN_TYPES = ('keyword', 'symbol', 'integerConstant', 'stringConstant',
+               'identifier')
+typeCodes = {lexType: code for code, lexType in enumerate(TOKEN_TYPES)}
+
+
+class TokenTable:
+
+    # Struct-of-arrays token storage: a type code and the [start, end)
+    # offsets of every token, pointing into the original source. Lexemes are
+    # only sliced out when a token is materialised
+    def __init__(self, source):
+        self.source = source
+        self.types = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+
+        # Offsets where each line starts, built on the first position lookup
+        self.lineStarts = None
+
+    def append(self, lexType, start, end):
+        self.types.append(typeCodes[lexType])
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        start = self.starts[i]
+        lexeme = self.source[start:self.ends[i]]
+        line, column = self.locate(start)
+        # Keywords and symbols come from a small fixed set, share one copy
+        return Token(TOKEN_TYPES[self.types[i]],
+                     internedLexemes.get(lexeme, lexeme), line, column)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def type(self, i):
+        return TOKEN_TYPES[self.types[i]]
+
+    def value(self, i):
+        lexeme = self.source[self.starts[i]:self.ends[i]]
+        return internedLexemes.get(lexeme, lexeme)
+
+    def position(self, i):
+        return self.locate(self.starts[i])
+
+    def locate(self, offset):
+        # The (line, column) of a source offset, both counted from 1
+        if self.lineStarts is None:
+            self.lineStarts = array('I', [0])
+            self.lineStarts.extend(
+                match.end() for match in re.finditer('\n', self.source))
+
+        line = bisect_right(self.lineStarts, offset)
+        return line, offset - self.lineStarts[line - 1] + 1
 
 
 class JackTokenizer:
 
     # Expressions for lexical elements in Jack
-    INT = '\d+'
+    INT = '[0-9]+'
     STR = '"[^"]*"'
-    ID = '[A-z_][A-z_\d]*'
-    SYMBOL = '\{|\}|\(|\)|\[|\]|\.|,|;|\+|-|\*|/|&|\||\<|\>|=|~'
-    KEYWORD = ('(class|constructor|function|method|field|static|var|int|char|'
-               'boolean|void|true|false|null|this|let|do|if|else|while|return)')
+    ID = '[A-Za-z_][A-Za-z_0-9]*'
+    SYMBOL = r'[{}()\[\].,;+\-*/&|<>=~^#]'
+    COMMENT = r'//[^\n]*|/\*.*?\*/'
+    KEYWORDS = frozenset((
+        'class', 'constructor', 'function', 'method', 'field', 'static',
+        'var', 'int', 'char', 'boolean', 'void', 'true', 'false', 'null',
+        'this', 'let', 'do', 'if', 'else', 'while', 'return'))
 
-    # A list of tuples of a regular expression and its type as string
-    LEXICAL_TYPES = [(KEYWORD, 'keyword'),
-                     (SYMBOL, 'symbol'),
-                     (INT, 'integerConstant'),
-                     (STR, 'stringConstant'),
-                     (ID, 'identifier')]
+    # The start of a string or block comment whose end is missing
+    UNTERMINATED = r'"[^"]*|/\*.*'
 
-    # A regular expression to split between lexical components/tokens
-    SPLIT = '(' + '|'.join(expr for expr in [SYMBOL, STR]) + ')|\s+'
+    # A single alternation matching exactly one lexical element at each
+    # position. Comments are tried before symbols so '/' can't steal them,
+    # and a string is consumed whole, so comment-like text inside it stays.
+    # An unterminated string or comment runs to the end of the source
+    LEXER = re.compile('|'.join((
+        '(?P<comment>{})'.format(COMMENT),
+        r'(?P<space>\s+)',
+        '(?P<stringConstant>{})'.format(STR),
+        '(?P<unterminated>{})'.format(UNTERMINATED),
+        '(?P<integerConstant>{})'.format(INT),
+        '(?P<identifier>{})'.format(ID),
+        '(?P<symbol>{})'.format(SYMBOL),
+        '(?P<error>.)')), re.DOTALL)
 
     @staticmethod
     def removeComments(file):
+        return JackTokenizer.LEXER.sub(
+            lambda match: '' if match.lastgroup == 'comment' else match.group(),
+            file)
 
-        # Use non-greedy regex to avoid eating lines of code
-        uncommented = re.sub('//.*?\n', '\n', file)
-        uncommented = re.sub('/\*.*?\*/', '', uncommented, flags=re.DOTALL)
-        return uncommented
+    @staticmethod
+    def error(lexType, lexeme, line, column):
+        if lexType == 'unterminated':
+            raise JackSyntaxError('unterminated {}'.format(
+                'string' if lexeme[0] == '"' else 'comment'), line, column)
+        raise JackSyntaxError('unknown token {}'.format(lexeme), line, column)
 
     def __init__(self, file):
-        self.code = JackTokenizer.removeComments(file)
+        self.code = file
         self.tokens = self.tokenize()
+        self.tokenCount = len(self.tokens)
+        # Index of the current token, tokens before it were consumed
+        self.pos = 0
+
+        # The current token, materialised once however often it is looked at
+        self.cachePos = -1
+        self.cacheToken = None
 
     def tokenize(self):
-        splitCode = re.split(self.SPLIT, self.code)
-        tokens = []
+        keywords = self.KEYWORDS
+        tokens = TokenTable(self.code)
 
-        for lex in splitCode:
+        for match in self.LEXER.finditer(self.code):
+            lexType = match.lastgroup
             # Skip non-tokens
-            if lex is None or re.match('^\s*$', lex):
+            if lexType == 'space' or lexType == 'comment':
                 continue
 
-            # Check all possible lexical types, if
-            for expr, lexType in self.LEXICAL_TYPES:
-                if re.match(expr, lex):
-                    tokens.append(Token(lexType, lex))
-                    break
-            else:
-                print('Error: unknown token', lex)
-                sys.exit(1)
+            if lexType == 'identifier' and match.group() in keywords:
+                lexType = 'keyword'
+            elif lexType == 'error' or lexType == 'unterminated':
+                self.error(lexType, match.group(),
+                           *tokens.locate(match.start()))
+
+            tokens.append(lexType, match.start(), match.end())
 
         return tokens
 
     def curToken(self):
-        return self.tokens[0] if self.tokens else None
+        return self.peek(0)
 
     def advance(self):
-        return self.tokens.pop(0) if self.tokens else None
+        token = self.peek(0)
+        if token:
+            self.pos += 1
+        return token
+
+    def peek(self, k=0):
+        # Look k tokens past the current one without consuming anything
+        pos = self.pos + k
+        if pos >= self.tokenCount:
+            return None
+
+        if pos != self.cachePos:
+            self.cachePos = pos
+            self.cacheToken = self.tokens[pos]
+        return self.cacheToken
+
+    def mark(self):
+        return self.pos
+
+    def reset(self, mark):
+        # Backtrack to a position previously returned by mark()
+        self.pos = mark
+
+    def release(self, mark):
+        # Every token is kept anyway, marks cost nothing
+        pass
+
+    def remaining(self):
+        return self.tokenCount - self.pos
+
+
+class JackTokenStream:
+
+    # The same interface as JackTokenizer, but the source file is memory
+    # mapped and tokenized lazily, a chunk at a time, as the engine consumes
+    # the tokens. Only a chunk of the source, and the tokens that weren't
+    # consumed yet or are held by a mark, are kept in memory
+    CHUNK_SIZE = 1 << 16
+    # Consumed tokens are dropped from the window in batches of at least this
+    TRIM_SIZE = 1024
+
+    def __init__(self, fp, chunkSize=CHUNK_SIZE):
+        self.fp = fp
+        self.chunkSize = chunkSize
+        self.lexer = self.lex()
+        self.window = []
+        self.base = 0  # Index of the first token in the window
+        self.pos = 0
+        self.marks = []
+
+    def lex(self):
+        with open(self.fp, 'rb') as file:
+            # An empty file can't be mapped, and has no tokens anyway
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield from self.lexChunks(data)
+
+    def lexChunks(self, data):
+        lexer = JackTokenizer.LEXER
+        keywords = JackTokenizer.KEYWORDS
+        # Decodes multi-byte characters split across chunks
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        size = len(data)
+
+        # The text not tokenized yet, the line it starts on, and where that
+        # line starts relative to it (negative if in an earlier chunk)
+        text = ''
+        line = 1
+        lineStart = 0
+        for offset in range(0, size, self.chunkSize):
+            final = offset + self.chunkSize >= size
+            text += decoder.decode(
+                data[offset:offset + self.chunkSize], final)
+
+            end = len(text)
+            counted = 0  # Newlines before it were counted in line
+            for match in lexer.finditer(text):
+                # A match reaching the end of the chunk may go on in the next
+                # one, it's lexed again once that is read
+                if match.end() == end and not final:
+                    end = match.start()
+                    break
+
+                lexType = match.lastgroup
+                if lexType == 'space' or lexType == 'comment':
+                    continue
+
+                start = match.start()
+                newlines = text.count('\n', counted, start)
+                if newlines:
+                    line += newlines
+                    lineStart = text.rindex('\n', counted, start) + 1
+                counted = start
+
+                lexeme = match.group()
+                if lexType == 'identifier' and lexeme in keywords:
+                    lexType = 'keyword'
+                elif lexType == 'error' or lexType == 'unterminated':
+                    JackTokenizer.error(
+                        lexType, lexeme, line, start - lineStart + 1)
+
+                yield Token(lexType, internedLexemes.get(lexeme, lexeme),
+                            line, start - lineStart + 1)
+
+            newlines = text.count('\n', counted, end)
+            if newlines:
+                line += newlines
+                lineStart = text.rindex('\n', counted, end) + 1
+            text = text[end:]
+            lineStart -= end
+
+    def fill(self, pos):
+        # Lex until the token at pos is in the window, False if there's none
+        window = self.window
+        while pos - self.base >= len(window):
+            token = next(self.lexer, None)
+            if token is None:
+                return False
+            window.append(token)
+        return True
+
+    def curToken(self):
+        return self.peek(0)
+
+    def advance(self):
+        token = self.peek(0)
+        if token:
+            self.pos += 1
+            # Drop the tokens no mark can come back to
+            keep = min(self.marks, default=self.pos)
+            if keep - self.base >= self.TRIM_SIZE:
+                del self.window[:keep - self.base]
+                self.base = keep
+        return token
+
+    def peek(self, k=0):
+        pos = self.pos + k
+        if not self.fill(pos):
+            return None
+        return self.window[pos - self.base]
+
+    def mark(self):
+        # Tokens from a mark on are kept until it is released
+        self.marks.append(self.pos)
+        return self.pos
+
+    def reset(self, mark):
+        self.pos = mark
+
+    def release(self, mark):
+        self.marks.remove(mark)
+
+    def remaining(self):
+        # Lexes the rest of the source, holding all of its tokens
+        while self.fill(self.base + len(self.window)):
+            pass
+        return self.base + len(self.window) - self.pos
+
+
+internedLexemes = {lexeme: lexeme for lexeme in JackTokenizer.KEYWORDS}
+internedLexemes.update((symbol, symbol) for symbol in '{}()[].,;+-*/&|<>=~^#')
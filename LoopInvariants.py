@@ -0,0 +1,97 @@
+# Finds the expressions of a loop that compute the same value on every
+# iteration, from its VM code alone. Expressions never branch, so following
+# the code in order, with the stack of the values it pushes, is enough to
+# tell where each of them starts and ends
+
+# Calls to these OS functions only compute from their arguments
+PURE_FUNCTIONS = ('Math.multiply', 'Math.abs', 'Math.min', 'Math.max')
+# Below this number of instructions, hoisting an expression out of the loop
+# doesn't pay for the local it takes. Expressions of constants alone are
+# never hoisted, pushing them is as cheap as pushing the local
+HOIST_SIZE = 3
+
+UNARY = ('neg', 'not', 'shiftleft', 'shiftright')
+BINARY = ('add', 'sub', 'and', 'or', 'lt', 'gt', 'eq')
+
+
+def findInvariants(instructions):
+    # The (start, end) ranges of the largest invariant expressions of the
+    # loop, worth hoisting, in order. Everything the loop pops into changes,
+    # and so do fields and statics if it calls anything else than the pure
+    # functions. Fields can also be written through arrays
+    written = set()
+    callsOut = False
+    storesArrays = False
+    for opcode, segment, index in instructions:
+        if opcode == 'pop':
+            written.add((segment, index))
+            storesArrays = storesArrays or segment == 'that'
+        elif opcode == 'call' and segment not in PURE_FUNCTIONS:
+            callsOut = True
+
+    def isInvariant(segment, index):
+        if segment == 'constant':
+            return True
+        elif (segment, index) in written:
+            return False
+        elif segment in ('local', 'argument') or (segment, index) == (
+                'pointer', '0'):
+            return True
+        elif segment == 'static':
+            return not callsOut
+        elif segment == 'this':
+            return not (callsOut or storesArrays)
+        return False
+
+    ranges = []
+
+    def settle(values):
+        # Values used by a computation that isn't invariant
+        for start, end, invariant, hasCall, readsVariable in values:
+            if invariant and (hasCall or (readsVariable
+                                          and end - start >= HOIST_SIZE)):
+                ranges.append((start, end))
+
+    # (start, end, invariant, hasCall, readsVariable) of each value on the
+    # stack
+    stack = []
+    for i, (opcode, segment, index) in enumerate(instructions):
+        if opcode == 'push':
+            stack.append((i, i + 1, isInvariant(segment, index), False,
+                          segment != 'constant'))
+            continue
+
+        if opcode in UNARY:
+            count = 1
+        elif opcode in BINARY:
+            count = 2
+        elif opcode == 'call':
+            count = int(index)
+        elif opcode in ('pop', 'if-goto', 'return'):
+            count = 1
+        elif opcode in ('label', 'goto'):
+            continue
+        else:
+            return []
+
+        if len(stack) < count:
+            return []
+        values = stack[len(stack) - count:]
+        del stack[len(stack) - count:]
+
+        if opcode in ('pop', 'if-goto', 'return'):
+            settle(values)
+            continue
+
+        invariant = all(value[2] for value in values)
+        hasCall = opcode == 'call' or any(value[3] for value in values)
+        readsVariable = any(value[4] for value in values)
+        if opcode == 'call':
+            invariant = invariant and segment in PURE_FUNCTIONS
+        if not invariant:
+            settle(values)
+
+        start = values[0][0] if values else i
+        stack.append((start, i + 1, invariant, hasCall, readsVariable))
+
+    return sorted(ranges)
@@ -0,0 +1,452 @@
+from VMWriter import toWord
+
+# Runs VM code in process, counting the instructions executed by every
+# function and the calls made to it. Memory is laid out as on the Hack
+# platform: the stack from 256, statics from 16, the heap from 2048. The OS
+# is stubbed in Python, unless the program brings its own classes for it
+
+RAM_SIZE = 32768
+STACK_BASE = 256
+STATIC_BASE = 16
+HEAP_BASE = 2048
+HEAP_END = 16384
+MAX_STEPS = 10 ** 8
+
+SP, LCL, ARG, THIS, THAT = range(5)
+TEMP_BASE = 5
+SEGMENT_BASES = {'local': LCL, 'argument': ARG, 'this': THIS, 'that': THAT}
+
+# Decoded opcodes, roughly by how often they run
+(PUSH_CONSTANT, PUSH_SEGMENT, PUSH_FIXED, POP_SEGMENT, POP_FIXED, ADD, SUB,
+ NEG, NOT, AND, OR, EQ, GT, LT, SHIFT_LEFT, SHIFT_RIGHT, GOTO, IF_GOTO,
+ CALL, BUILTIN, RETURN, FUNCTION) = range(22)
+
+ARITHMETIC = {'add': ADD, 'sub': SUB, 'neg': NEG, 'not': NOT, 'and': AND,
+              'or': OR, 'eq': EQ, 'gt': GT, 'lt': LT,
+              'shiftleft': SHIFT_LEFT, 'shiftright': SHIFT_RIGHT}
+
+# A return address ending the run, when the entry function returns
+EXIT = -1
+
+
+class VMError(Exception):
+    pass
+
+
+class Halt(Exception):
+    pass
+
+
+def checkAddress(address):
+    # Python would wrap a negative address around to the top of RAM
+    if not 0 <= address < RAM_SIZE:
+        raise VMError('address out of range {}'.format(address))
+    return address
+
+
+class JackOS:
+
+    # The OS classes as Python functions, over the interpreter's memory.
+    # Strings are heap blocks of [capacity, length, chars...]
+    def __init__(self, ram):
+        self.ram = ram
+        self.heapTop = HEAP_BASE
+        self.output = []
+        self.functions = {
+            'Math.multiply': self.multiply, 'Math.divide': self.divide,
+            'Math.min': min, 'Math.max': max, 'Math.abs': abs,
+            'Math.sqrt': lambda x: int(max(x, 0) ** 0.5),
+            'Memory.alloc': self.alloc, 'Memory.deAlloc': self.ignore,
+            'Memory.peek': lambda address: ram[checkAddress(address)],
+            'Memory.poke': self.poke,
+            'Array.new': self.alloc, 'Array.dispose': self.ignore,
+            'String.new': self.newString, 'String.dispose': self.ignore,
+            'String.length': lambda s: ram[s + 1],
+            'String.charAt': lambda s, i: ram[s + 2 + i],
+            'String.setCharAt': self.setCharAt,
+            'String.appendChar': self.appendChar,
+            'String.eraseLastChar': self.eraseLastChar,
+            'String.intValue': self.intValue, 'String.setInt': self.setInt,
+            'String.backSpace': lambda: 129, 'String.doubleQuote': lambda: 34,
+            'String.newLine': lambda: 128,
+            'Output.printString': self.printString,
+            'Output.printInt': lambda n: self.print(str(n)),
+            'Output.printChar': lambda c: self.print(self.char(c)),
+            'Output.println': lambda: self.print('\n'),
+            'Output.backSpace': self.ignore, 'Output.moveCursor': self.ignore,
+            'Sys.halt': self.halt, 'Sys.error': self.error,
+            'Sys.wait': self.ignore,
+            'Keyboard.keyPressed': lambda: 0, 'Keyboard.readChar': lambda: 0,
+            'Keyboard.readInt': lambda message: 0,
+            'Keyboard.readLine': lambda message: self.newString(0)}
+        for name in ('clearScreen', 'setColor', 'drawPixel', 'drawLine',
+                     'drawRectangle', 'drawCircle'):
+            self.functions['Screen.' + name] = self.ignore
+
+    @staticmethod
+    def ignore(*args):
+        return 0
+
+    @staticmethod
+    def multiply(a, b):
+        return toWord(a * b)
+
+    @staticmethod
+    def divide(a, b):
+        if b == 0:
+            raise VMError('division by zero')
+        quotient = abs(a) // abs(b)
+        return quotient if (a < 0) == (b < 0) else -quotient
+
+    @staticmethod
+    def halt():
+        raise Halt()
+
+    @staticmethod
+    def error(code):
+        raise VMError('Sys.error({})'.format(code))
+
+    def alloc(self, size):
+        # A bump allocator, nothing is ever freed
+        if size < 0:
+            raise VMError('negative allocation size {}'.format(size))
+        block = self.heapTop
+        self.heapTop += max(size, 1)
+        if self.heapTop > HEAP_END:
+            raise VMError('heap overflow')
+        return block
+
+    def poke(self, address, value):
+        self.ram[checkAddress(address)] = value
+        return 0
+
+    def newString(self, capacity):
+        block = self.alloc(capacity + 2)
+        self.ram[block] = capacity
+        self.ram[block + 1] = 0
+        return block
+
+    def appendChar(self, s, c):
+        length = self.ram[s + 1]
+        if length >= self.ram[s]:
+            raise VMError('string is full')
+        self.ram[s + 2 + length] = c
+        self.ram[s + 1] = length + 1
+        return s
+
+    def setCharAt(self, s, i, c):
+        self.ram[s + 2 + i] = c
+        return 0
+
+    def eraseLastChar(self, s):
+        self.ram[s + 1] = max(self.ram[s + 1] - 1, 0)
+        return 0
+
+    def string(self, s):
+        length = self.ram[s + 1]
+        return ''.join(self.char(c) for c in self.ram[s + 2:s + 2 + length])
+
+    def intValue(self, s):
+        text = self.string(s)
+        digits = len(text) - len(text.lstrip('-').lstrip('0123456789'))
+        try:
+            return toWord(int(text[:digits]))
+        except ValueError:
+            return 0
+
+    def setInt(self, s, n):
+        self.ram[s + 1] = 0
+        for c in str(n):
+            self.appendChar(s, ord(c))
+        return 0
+
+    @staticmethod
+    def char(c):
+        return {128: '\n', 129: '\b', 34: '"'}.get(c, chr(c & 0x7F))
+
+    def print(self, text):
+        self.output.append(text)
+        return 0
+
+    def printString(self, s):
+        return self.print(self.string(s))
+
+
+class VMInterpreter:
+
+    # functions is {name: instructions}, as JackProgram.functions() gives
+    # them, with the function command first. Calls to functions that aren't
+    # there go to the OS stubs
+    def __init__(self, functions, maxSteps=MAX_STEPS):
+        self.maxSteps = maxSteps
+        self.ram = [0] * RAM_SIZE
+        self.os = JackOS(self.ram)
+
+        self.names = list(functions)
+        self.entries = dict()
+        self.staticAddresses = dict()
+        self.code = []
+        # The function of every decoded instruction, to attribute counts
+        self.owners = []
+        for index, name in enumerate(self.names):
+            self.entries[name] = len(self.code)
+            self.decodeFunction(index, name, functions[name])
+
+        self.link()
+
+        self.callCounts = [0] * len(self.names)
+        self.builtinCalls = dict()
+        self.steps = 0
+        self.counts = [0] * len(self.code)
+
+    def staticAddress(self, className, index):
+        key = '{}.{}'.format(className, index)
+        if key not in self.staticAddresses:
+            self.staticAddresses[key] = \
+                STATIC_BASE + len(self.staticAddresses)
+            if self.staticAddresses[key] >= STACK_BASE:
+                raise VMError('too many statics')
+        return self.staticAddresses[key]
+
+    def decodeFunction(self, index, name, instructions):
+        className = name.split('.')[0]
+        # Labels are resolved to the position of the next instruction, once
+        # the whole function is decoded
+        labels = dict()
+        jumps = []
+        for opcode, arg1, arg2 in instructions:
+            if opcode == 'label':
+                labels[arg1] = len(self.code)
+                continue
+
+            if opcode == 'push' or opcode == 'pop':
+                offset = int(arg2)
+                if arg1 == 'constant':
+                    decoded = (PUSH_CONSTANT, offset, None)
+                elif arg1 in SEGMENT_BASES:
+                    decoded = (PUSH_SEGMENT if opcode == 'push'
+                               else POP_SEGMENT, SEGMENT_BASES[arg1], offset)
+                else:
+                    if arg1 == 'temp':
+                        address = TEMP_BASE + offset
+                    elif arg1 == 'pointer':
+                        address = THIS + offset
+                    elif arg1 == 'static':
+                        address = self.staticAddress(className, offset)
+                    else:
+                        raise VMError('unknown segment {}'.format(arg1))
+                    decoded = (PUSH_FIXED if opcode == 'push' else POP_FIXED,
+                               address, None)
+            elif opcode in ARITHMETIC:
+                decoded = (ARITHMETIC[opcode], None, None)
+            elif opcode == 'goto' or opcode == 'if-goto':
+                jumps.append(len(self.code))
+                decoded = (GOTO if opcode == 'goto' else IF_GOTO, arg1, None)
+            elif opcode == 'call':
+                # Resolved to an entry point once every function is decoded
+                decoded = (CALL, arg1, int(arg2))
+            elif opcode == 'return':
+                decoded = (RETURN, None, None)
+            elif opcode == 'function':
+                decoded = (FUNCTION, int(arg2), None)
+            else:
+                raise VMError('unknown VM command {}'.format(opcode))
+
+            self.code.append(decoded)
+            self.owners.append(index)
+
+        for position in jumps:
+            op, label, _ = self.code[position]
+            if label not in labels:
+                raise VMError('{}: unknown label {}'.format(name, label))
+            self.code[position] = (op, labels[label], None)
+
+    def link(self):
+        # Point every call at its function, or at the OS stub
+        indices = {name: index for index, name in enumerate(self.names)}
+        for position, (op, name, argCount) in enumerate(self.code):
+            if op != CALL:
+                continue
+            if name in indices:
+                self.code[position] = (CALL, indices[name], argCount)
+            elif name in self.os.functions:
+                self.code[position] = (BUILTIN, name, argCount)
+            else:
+                raise VMError('call to undefined function {}'.format(name))
+
+    def run(self, entry):
+        # Run the program from its entry function. Returns whether it ended,
+        # by returning from the entry or calling Sys.halt, before the step
+        # limit
+        if entry not in self.entries:
+            raise VMError('entry point {} is not defined'.format(entry))
+
+        ram = self.ram
+        code = self.code
+        counts = self.counts
+        callCounts = self.callCounts
+        entries = [self.entries[name] for name in self.names]
+        builtins = self.os.functions
+
+        # The entry is called with no arguments, returning to EXIT
+        sp = STACK_BASE
+        ram[sp:sp + 5] = [EXIT, 0, 0, 0, 0]
+        sp += 5
+        ram[ARG] = STACK_BASE
+        ram[LCL] = sp
+        callCounts[self.names.index(entry)] += 1
+        pc = self.entries[entry]
+
+        steps = 0
+        maxSteps = self.maxSteps
+        try:
+            while steps < maxSteps:
+                op, a, b = code[pc]
+                counts[pc] += 1
+                steps += 1
+                pc += 1
+
+                if op == PUSH_CONSTANT:
+                    ram[sp] = a
+                    sp += 1
+                elif op == PUSH_SEGMENT:
+                    address = ram[a] + b
+                    if not 0 <= address < RAM_SIZE:
+                        # Python would wrap a negative one to the top of RAM
+                        raise VMError(
+                            'address out of range {}'.format(address))
+                    ram[sp] = ram[address]
+                    sp += 1
+                elif op == PUSH_FIXED:
+                    ram[sp] = ram[a]
+                    sp += 1
+                elif op == POP_SEGMENT:
+                    address = ram[a] + b
+                    if not 0 <= address < RAM_SIZE:
+                        # Python would wrap a negative one to the top of RAM
+                        raise VMError(
+                            'address out of range {}'.format(address))
+                    sp -= 1
+                    ram[address] = ram[sp]
+                elif op == POP_FIXED:
+                    sp -= 1
+                    ram[a] = ram[sp]
+                elif op <= OR:
+                    if op == NEG:
+                        ram[sp - 1] = toWord(-ram[sp - 1])
+                    elif op == NOT:
+                        ram[sp - 1] = ~ram[sp - 1]
+                    else:
+                        sp -= 1
+                        y = ram[sp]
+                        x = ram[sp - 1]
+                        if op == ADD:
+                            ram[sp - 1] = toWord(x + y)
+                        elif op == SUB:
+                            ram[sp - 1] = toWord(x - y)
+                        elif op == AND:
+                            ram[sp - 1] = x & y
+                        else:
+                            ram[sp - 1] = x | y
+                elif op <= LT:
+                    sp -= 1
+                    y = ram[sp]
+                    x = ram[sp - 1]
+                    if op == EQ:
+                        ram[sp - 1] = -(x == y)
+                    elif op == GT:
+                        ram[sp - 1] = -(x > y)
+                    else:
+                        ram[sp - 1] = -(x < y)
+                elif op == SHIFT_LEFT:
+                    ram[sp - 1] = toWord(ram[sp - 1] << 1)
+                elif op == SHIFT_RIGHT:
+                    ram[sp - 1] >>= 1
+                elif op == GOTO:
+                    pc = a
+                elif op == IF_GOTO:
+                    sp -= 1
+                    if ram[sp]:
+                        pc = a
+                elif op == CALL:
+                    callCounts[a] += 1
+                    ram[sp] = pc
+                    ram[sp + 1] = ram[LCL]
+                    ram[sp + 2] = ram[ARG]
+                    ram[sp + 3] = ram[THIS]
+                    ram[sp + 4] = ram[THAT]
+                    sp += 5
+                    ram[ARG] = sp - 5 - b
+                    ram[LCL] = sp
+                    pc = entries[a]
+                elif op == BUILTIN:
+                    self.builtinCalls[a] = self.builtinCalls.get(a, 0) + 1
+                    sp -= b
+                    ram[sp] = toWord(builtins[a](*ram[sp:sp + b]) or 0)
+                    sp += 1
+                elif op == RETURN:
+                    frame = ram[LCL]
+                    pc = ram[frame - 5]
+                    ram[ram[ARG]] = ram[sp - 1]
+                    sp = ram[ARG] + 1
+                    ram[THAT] = ram[frame - 1]
+                    ram[THIS] = ram[frame - 2]
+                    ram[ARG] = ram[frame - 3]
+                    ram[LCL] = ram[frame - 4]
+                    if pc == EXIT:
+                        return True
+                elif op == FUNCTION:
+                    ram[sp:sp + a] = [0] * a
+                    sp += a
+
+                if sp >= HEAP_BASE:
+                    raise VMError('stack overflow')
+            return False
+        except Halt:
+            return True
+        finally:
+            self.steps = steps
+            ram[SP] = sp
+
+    @property
+    def output(self):
+        return ''.join(self.os.output)
+
+    def statics(self):
+        # {'Class.index': value} of every static variable
+        return {key: self.ram[address]
+                for key, address in self.staticAddresses.items()}
+
+    def functionCounts(self):
+        # {function: instructions executed in it}
+        counts = dict.fromkeys(self.names, 0)
+        for owner, count in zip(self.owners, self.counts):
+            counts[self.names[owner]] += count
+        return counts
+
+    def stats(self):
+        instructions = self.functionCounts()
+        return {'steps': self.steps,
+                'functions': {name: {'instructions': instructions[name],
+                                     'calls': calls}
+                              for name, calls in zip(self.names,
+                                                     self.callCounts)},
+                'os': dict(self.builtinCalls)}
+
+
+def formatStats(stats, top=15):
+    lines = ['{} instructions executed'.format(stats['steps']),
+             '{:>12} {:>8}  {}'.format('instructions', 'calls', 'function')]
+    functions = sorted(stats['functions'].items(),
+                       key=lambda item: -item[1]['instructions'])
+    lines.extend('{:>12} {:>8}  {}'.format(
+        counts['instructions'], counts['calls'], name)
+        for name, counts in functions[:top] if counts['calls'])
+
+    if stats['os']:
+        lines.append('')
+        lines.append('{:>12}  {}'.format('OS calls', 'function'))
+        lines.extend('{:>12}  {}'.format(calls, name) for name, calls in
+                     sorted(stats['os'].items(), key=lambda item: -item[1]))
+
+    return '\n'.join(lines)
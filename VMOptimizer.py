@@ -0,0 +1,125 @@
+# Peephole rules rewrite the tail of the instruction stream while it is being
+# rebuilt, so a rewrite exposing another pattern is caught right away. Every
+# rule looks at a window of its size and returns the instructions to put in
+# its place, or None when it doesn't apply
+
+
+class PeepholeRule:
+
+    name = None
+    size = 0
+
+    def __init__(self):
+        self.count = 0
+
+    def rewrite(self, window):
+        raise NotImplementedError
+
+
+class PushPop(PeepholeRule):
+
+    # push X / pop X stores a value right back where it came from
+    name = 'push-pop'
+    size = 2
+
+    def rewrite(self, window):
+        push, pop = window
+        if push[0] == 'push' and pop[0] == 'pop' and push[1:] == pop[1:]:
+            return []
+        return None
+
+
+class DoubleNot(PeepholeRule):
+
+    # not / not, typically a negated condition negated again by writeIf
+    name = 'double-not'
+    size = 2
+
+    def rewrite(self, window):
+        if window[0][0] == 'not' and window[1][0] == 'not':
+            return []
+        return None
+
+
+class ArrayStoreTemp(PeepholeRule):
+
+    # In an array let, the assigned value is parked in temp 0 while pointer 1
+    # is set. A value pushed by a single instruction that doesn't depend on
+    # pointer 1 can be pushed after it instead
+    name = 'array-store-temp'
+    size = 5
+    safeSegments = ('constant', 'local', 'argument', 'this', 'static')
+
+    def rewrite(self, window):
+        value, *store = window
+        if store != [('pop', 'temp', '0'), ('pop', 'pointer', '1'),
+                     ('push', 'temp', '0'), ('pop', 'that', '0')]:
+            return None
+        if value[0] != 'push' or (value[1] not in self.safeSegments
+                                  and value[1:] != ('pointer', '0')):
+            return None
+
+        return [store[1], value, store[3]]
+
+
+class UnreachableCode(PeepholeRule):
+
+    # Nothing after a return or a goto runs, until the next label or function
+    name = 'unreachable-code'
+    size = 2
+
+    def rewrite(self, window):
+        jump, instruction = window
+        if jump[0] in ('return', 'goto') \
+                and instruction[0] not in ('label', 'function'):
+            return [jump]
+        return None
+
+
+class JumpToNext(PeepholeRule):
+
+    # goto L / label L, a jump to the very next instruction
+    name = 'jump-to-next'
+    size = 2
+
+    def rewrite(self, window):
+        goto, label = window
+        if goto[0] == 'goto' and label[0] == 'label' and goto[1] == label[1]:
+            return [label]
+        return None
+
+
+DEFAULT_RULES = (PushPop, DoubleNot, ArrayStoreTemp, UnreachableCode,
+                 JumpToNext)
+
+
+class VMOptimizer:
+
+    def __init__(self, rules=DEFAULT_RULES):
+        self.rules = [rule() for rule in rules]
+
+    def optimize(self, instructions):
+        output = []
+        for instruction in instructions:
+            output.append(instruction)
+
+            # Keep rewriting the tail as long as some rule applies
+            rewritten = True
+            while rewritten:
+                rewritten = False
+                for rule in self.rules:
+                    size = rule.size
+                    if len(output) < size:
+                        continue
+
+                    replacement = rule.rewrite(output[-size:])
+                    if replacement is not None:
+                        output[-size:] = replacement
+                        rule.count += 1
+                        rewritten = True
+                        break
+
+        return output
+
+    def stats(self):
+        return {rule.name: rule.count for rule in self.rules}
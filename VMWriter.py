@@ -1,70 +1,238 @@
-kindToSegment = {'static': 'static',
-                 'field': 'this',
-                 'arg': 'argument',
-                 'var': 'local'}
+BINARY_OPCODES = ('add', 'sub', 'and', 'or', 'lt', 'gt', 'eq')
+UNARY_OPCODES = ('neg', 'not', 'shiftleft', 'shiftright')
+
+
+def toWord(n):
+    # Wrap an integer to the signed 16 bit range of the Hack platform
+    n &= 0xFFFF
+    return n - 0x10000 if n & 0x8000 else n
+
+
+def formatInstruction(instruction):
+    opcode, arg1, arg2 = instruction
+    if arg1 is None:
+        return opcode
+    elif arg2 is None:
+        return opcode + ' ' + arg1
+
+    return opcode + ' ' + arg1 + ' ' + arg2
+
+
+def formatInstructions(instructions):
+    return ''.join(formatInstruction(instruction) + '\n'
+                   for instruction in instructions)
 
 
 class VMWriter:
 
-    def __init__(self, oStream):
+    # Commands are buffered as (opcode, arg1, arg2) entries, unused arguments
+    # being None, and written out in bulk by flush(), after going through the
+    # optimizer if there is one. With a chunk size the buffer is also flushed
+    # once it grows past it, but only between functions. Without an output
+    # stream nothing is ever written, and the flushed instructions are kept
+    # in the buffer for the caller
+    def __init__(self, oStream, chunkSize=None, optimizer=None):
         self.oStream = oStream
-        self.labelCount = 0
+        self.chunkSize = chunkSize
+        self.optimizer = optimizer
+        self.instructions = []
+        self.flushed = 0  # Instructions already flushed, without a stream
+
+    def flush(self):
+        pending = self.instructions[self.flushed:]
+        if not pending:
+            return
+
+        if self.optimizer:
+            pending = self.optimizer.optimize(pending)
+
+        if self.oStream is None:
+            self.instructions[self.flushed:] = pending
+            self.flushed = len(self.instructions)
+        else:
+            self.oStream.write(self.render(pending))
+            self.instructions = []
+
+    def render(self, instructions):
+        # The text written out for the instructions
+        return formatInstructions(instructions)
+
+    def mark(self):
+        # A position in the buffer, valid until the end of the function
+        return len(self.instructions)
+
+    def remove(self, start, end=None):
+        del self.instructions[start:end]
+
+    def isPure(self, start, end=None):
+        # Whether the instructions in the range can be dropped without
+        # losing a side effect, which in compiled code only calls have
+        return all(opcode != 'call'
+                   for opcode, _, _ in self.instructions[start:end])
+
+    def constantAt(self, start, end=None):
+        # The value computed by the instructions in the range, if they are a
+        # constant as written by writeInt/writeConstant, otherwise None
+        instructions = self.instructions[start:end]
+        if not instructions or len(instructions) > 2:
+            return None
+
+        opcode, segment, n = instructions[0]
+        if opcode != 'push' or segment != 'constant':
+            return None
+        n = int(n)
+
+        if len(instructions) == 1:
+            return toWord(n)
+        elif instructions[1][0] == 'neg':
+            return toWord(-n)
+        elif instructions[1][0] == 'not':
+            return toWord(~n)
+        return None
+
+    def expressionStart(self, end):
+        # Where the expression whose value the instructions up to end push
+        # begins, or None if they aren't an expression
+        needed = 1
+        for i in range(end - 1, -1, -1):
+            opcode, segment, n = self.instructions[i]
+            if opcode == 'push':
+                needed -= 1
+            elif opcode in BINARY_OPCODES or opcode == 'pop':
+                # Array reads pop their address into pointer 1
+                needed += 1
+            elif opcode == 'call':
+                needed += int(n) - 1
+            elif opcode in ('label', 'goto', 'if-goto', 'function', 'return'):
+                return None
+            # Unary commands leave the count unchanged
+
+            if needed == 0:
+                return i
+        return None
+
+    def isBoolean(self, start, end=None):
+        # Whether the expression in the range can only be true (-1) or
+        # false (0), conditions otherwise only holding if they are -1
+        if end is None:
+            end = len(self.instructions)
+        if end <= start:
+            return False
+
+        value = self.constantAt(start, end)
+        if value is not None:
+            return value in (0, -1)
+
+        opcode = self.instructions[end - 1][0]
+        if opcode in ('lt', 'gt', 'eq'):
+            return True
+        elif opcode == 'not':
+            return self.isBoolean(start, end - 1)
+        elif opcode in ('and', 'or'):
+            middle = self.expressionStart(end - 1)
+            return middle is not None and middle > start \
+                and self.isBoolean(start, middle) \
+                and self.isBoolean(middle, end - 1)
+        return False
+
+    def isReadOnly(self, start, end=None):
+        # Whether the instructions in the range only push and compute, and so
+        # leave pointer 1 and memory as they were
+        return all(opcode not in ('pop', 'call', 'label', 'goto', 'if-goto')
+                   for opcode, _, _ in self.instructions[start:end])
+
+    def onlyReads(self, start, segments):
+        # Whether the instructions from start only compute from the given
+        # segments, without calls
+        return all(opcode in UNARY_OPCODES or opcode in BINARY_OPCODES
+                   or (opcode == 'push' and segment in segments)
+                   for opcode, segment, _ in self.instructions[start:])
 
     def writeIf(self, label):
-        self.oStream.write(
-            'not\n')  # Negate to jump if the conditions doesn't hold
-        self.oStream.write('if-goto {}\n'.format(label))
+        self.instructions.append(
+            ('not', None, None))  # Negate to jump if the conditions doesn't hold
+        self.instructions.append(('if-goto', label, None))
+
+    def writeIfTrue(self, label):
+        # Jump if the condition holds, as if-goto does
+        self.instructions.append(('if-goto', label, None))
 
     def writeGoto(self, label):
-        self.oStream.write('goto {}\n'.format(label))
+        self.instructions.append(('goto', label, None))
 
     def writeLabel(self, label):
-        self.oStream.write('label {}\n'.format(label))
+        self.instructions.append(('label', label, None))
 
     def writeFunction(self, jackSubroutine):
+        pending = len(self.instructions) - self.flushed
+        if self.chunkSize and pending >= self.chunkSize:
+            self.flush()
+
         className = jackSubroutine.jackClass.name
         name = jackSubroutine.name
         localVars = jackSubroutine.varSymbols
 
-        self.oStream.write('function {}.{} {}\n'.format(className, name, localVars))
+        self.instructions.append(
+            ('function', '{}.{}'.format(className, name), str(localVars)))
+
+    def updateFunction(self, position, jackSubroutine):
+        # Rewrite the function command at position, once the subroutine's
+        # locals are all known
+        opcode, name, _ = self.instructions[position]
+        self.instructions[position] = (opcode, name,
+                                       str(jackSubroutine.varSymbols))
 
     def writeReturn(self):
-        self.oStream.write('return\n')
+        self.instructions.append(('return', None, None))
 
     def writeCall(self, className, funcName, argCount):
-        self.oStream.write('call {0}.{1} {2}\n'.format(
-            className, funcName, argCount))
+        self.instructions.append(
+            ('call', '{}.{}'.format(className, funcName), str(argCount)))
 
     def writePopSymbol(self, jackSymbol):
-        kind = jackSymbol.kind
-        offset = jackSymbol.id  # the offset in the segment
-
-        segment = kindToSegment[kind]
-        self.writePop(segment, offset)
+        # Symbols carry their segment and offset, resolved when declared
+        self.instructions.append(
+            ('pop', jackSymbol.segment, jackSymbol.offset))
 
     def writePushSymbol(self, jackSymbol):
-        kind = jackSymbol.kind
-        offset = jackSymbol.id  # the offset in the segment
-
-        segment = kindToSegment[kind]
-        self.writePush(segment, offset)
+        self.instructions.append(
+            ('push', jackSymbol.segment, jackSymbol.offset))
 
     def writePop(self, segment, offset):
-        self.oStream.write('pop {0} {1}\n'.format(segment, offset))
+        self.instructions.append(('pop', segment, str(offset)))
 
     def writePush(self, segment, offset):
-        self.oStream.write('push {0} {1}\n'.format(segment, offset))
+        self.instructions.append(('push', segment, str(offset)))
 
     def write(self, action):
-        self.oStream.write('{}\n'.format(action))
+        # A raw command, such as 'add' or 'call Math.multiply 2'
+        opcode, *args = action.split()
+        args += [None] * (2 - len(args))
+        self.instructions.append((opcode, args[0], args[1]))
 
     def writeInt(self, n):
         self.writePush('constant', n)
 
+    def writeConstant(self, value):
+        # Any 16 bit value, while constants only go up to 32767
+        value = toWord(value)
+        if value >= 0:
+            self.writeInt(value)
+        elif value == -1:
+            self.writeInt(0)
+            self.write('not')
+        elif value == -0x8000:
+            self.writeInt(0x7FFF)
+            self.write('not')
+        else:
+            self.writeInt(-value)
+            self.write('neg')
+
     def writeStr(self, s):
         s = s[1:-1]
         self.writeInt(len(s))
-        self.writeCall('string', 'new', 1)
+        self.writeCall('String', 'new', 1)
+        append = self.instructions.append
         for c in s:
-            self.writeInt(ord(c))
-            self.writeCall('string', 'appendChar', 2)
+            append(('push', 'constant', str(ord(c))))
+            append(('call', 'String.appendChar', '2'))
@@ -0,0 +1,94 @@
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from JackTokenizer import JackTokenizer
+from CompilationEngine import CompilationEngine
+
+# Machine-generated style expressions: parentheses, unary operators, array
+# reads and calls nested to a given depth, in statements of a single class
+STATEMENTS = 400
+DEPTHS = [4, 16, 64, 256, 2000]
+REPEAT = 5
+
+
+def expression(rng, depth):
+    # Built from the inside out, generating mustn't hit the recursion limit
+    code = rng.choice(('x', 'y', str(rng.randint(0, 99))))
+    for _ in range(depth):
+        kind = rng.randrange(5)
+        if kind == 0:
+            code = '({}) + {}'.format(code, rng.choice('xy'))
+        elif kind == 1:
+            code = '-({})'.format(code)
+        elif kind == 2:
+            code = 'a[{}]'.format(code)
+        elif kind == 3:
+            code = 'Math.max({}, x)'.format(code)
+        else:
+            code = '~({}) * {}'.format(code, rng.randint(2, 9))
+
+    return code
+
+
+def generateClass(depth, statements=STATEMENTS, seed=1):
+    rng = random.Random(seed)
+    count = max(1, statements * 4 // (depth + 4))
+    lines = ['class Nesting {',
+             '    function int f(Array a, int x) {',
+             '        var int y;',
+             '        let y = 0;']
+    lines.extend('        let y = {};'.format(expression(rng, depth))
+                 for _ in range(count))
+    lines.extend(['        return y;', '    }', '}'])
+    return '\n'.join(lines) + '\n'
+
+
+def timeCompile(source, iterative, repeat=REPEAT):
+    # The best of a few runs, tokenizing is left out
+    best = None
+    for _ in range(repeat):
+        tokenizer = JackTokenizer(source)
+        output = io.StringIO()
+        start = time.perf_counter()
+        try:
+            CompilationEngine(tokenizer, output,
+                              iterative=iterative).compileClass()
+        except RecursionError:
+            return None, None
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, output.getvalue()
+
+
+def main():
+    depths = [int(arg) for arg in sys.argv[1:]] or DEPTHS
+
+    print('{:>8} {:>8} {:>14} {:>14} {:>9}'.format(
+        'depth', 'tokens', 'recursive ms', 'iterative ms', 'speedup'))
+    for depth in depths:
+        source = generateClass(depth)
+        tokens = len(JackTokenizer(source).tokens)
+        recursive, recursiveCode = timeCompile(source, False)
+        iterative, iterativeCode = timeCompile(source, True)
+
+        if recursive is None:
+            print('{:>8} {:>8} {:>14} {:>14.1f} {:>9}'.format(
+                depth, tokens, 'too deep', iterative * 1000, '-'))
+            continue
+
+        if recursiveCode != iterativeCode:
+            print('{:>8} the engines generated different code'.format(depth))
+            sys.exit(1)
+        print('{:>8} {:>8} {:>14.1f} {:>14.1f} {:>8.2f}x'.format(
+            depth, tokens, recursive * 1000, iterative * 1000,
+            recursive / iterative))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from JackCorpus import CorpusGenerator, DEFAULTS
+from JackTokenizer import JackTokenizer
+from CompilationEngine import CompilationEngine
+import JackCompiler
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+# Throughputs higher is better, peak memory lower is better
+STAGES = ('tokenizer', 'engine', 'compileDir')
+
+# A fixed workload, independent of the compiler, timed along with the
+# stages. Each stage is compared by its time relative to it, so a baseline
+# measured on one machine still means something on another
+CALIBRATION_TEXT = ' '.join('let x{0} = y{0} + {0}; // {0}'.format(i)
+                            for i in range(20000))
+CALIBRATION_PATTERN = re.compile(r'[A-Za-z_]\w*|\d+|//[^;]*|\S')
+
+
+def bestOf(repeat, run):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def calibrate():
+    # Regular expressions, dicts, lists and string slicing, as the compiler
+    # spends its time in
+    counts = dict()
+    instructions = []
+    for match in CALIBRATION_PATTERN.finditer(CALIBRATION_TEXT):
+        lexeme = match.group()
+        counts[lexeme[:2]] = counts.get(lexeme[:2], 0) + 1
+        instructions.append(('push', lexeme, str(len(instructions))))
+    return '\n'.join(' '.join(instruction) for instruction in instructions)
+
+
+def benchmark(generator, repeat=3, options=None):
+    options = options or {}
+    sources = list(generator.generate().values())
+    lines = sum(source.count('\n') for source in sources)
+    tokens = sum(len(JackTokenizer(source).tokens) for source in sources)
+
+    def tokenize():
+        for source in sources:
+            JackTokenizer(source)
+
+    def compileTokens():
+        # Tokenizing is left out, by timing over pre-tokenized sources
+        tokenizers = [JackTokenizer(source) for source in sources]
+        start = time.perf_counter()
+        for tokenizer in tokenizers:
+            compiler = CompilationEngine(tokenizer, io.StringIO(), **options)
+            compiler.compileClass()
+        return time.perf_counter() - start
+
+    # Timed before and after the stages, in case the machine's speed drifts
+    calibration = bestOf(repeat, calibrate)
+
+    with tempfile.TemporaryDirectory() as dirPath:
+        generator.writeTo(dirPath)
+        with contextlib.redirect_stdout(io.StringIO()):
+            compileDirTime = bestOf(repeat, lambda: JackCompiler.compileDir(
+                dirPath, options=options))
+
+    times = {'tokenizer': bestOf(repeat, tokenize),
+             'engine': min(compileTokens() for _ in range(repeat)),
+             'compileDir': compileDirTime}
+    calibration = min(calibration, bestOf(repeat, calibrate))
+
+    tracemalloc.start()
+    for source in sources:
+        CompilationEngine(JackTokenizer(source), io.StringIO(),
+                          **options).compileClass()
+    _, peakMemory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results = {'corpus': generator.params(),
+               'options': options,
+               'lines': lines,
+               'tokens': tokens,
+               'peakMemory': peakMemory,
+               'calibrationSeconds': calibration}
+    for stage in STAGES:
+        results[stage] = {'seconds': times[stage],
+                          'linesPerSec': lines / times[stage],
+                          'tokensPerSec': tokens / times[stage],
+                          # Machine independent, what the baseline compares
+                          'relativeCost': times[stage] / calibration}
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Returns report lines, and whether anything regressed past tolerance
+    lines = []
+    regressed = False
+
+    for stage in STAGES:
+        ratio = baseline[stage]['relativeCost'] / \
+            results[stage]['relativeCost']
+        slower = ratio < 1 - tolerance
+        regressed = regressed or slower
+        lines.append('{:<12} {:>7.2f}x throughput{}'.format(
+            stage, ratio, '  REGRESSION' if slower else ''))
+
+    ratio = results['peakMemory'] / baseline['peakMemory']
+    bigger = ratio > 1 + tolerance
+    regressed = regressed or bigger
+    lines.append('{:<12} {:>7.2f}x peak memory{}'.format(
+        'memory', ratio, '  REGRESSION' if bigger else ''))
+
+    return lines, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the compiler over a synthetic Jack corpus')
+    for name, default in DEFAULTS.items():
+        parser.add_argument('--' + name, type=type(default), default=default)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per stage, the best one is kept')
+    parser.add_argument('-O', '--optimize', action='store_true')
+    parser.add_argument('--iterative', action='store_true',
+                        help='use the explicit-stack expression compiler')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='the stored results to compare against')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='the relative slowdown reported as regression')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    generator = CorpusGenerator(**{name: getattr(args, name)
+                                   for name in DEFAULTS})
+    options = dict()
+    if args.optimize:
+        options['optimize'] = True
+    if args.iterative:
+        options['iterative'] = True
+    results = benchmark(generator, args.repeat, options)
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+    else:
+        print('{} lines, {} tokens, {} classes'.format(
+            results['lines'], results['tokens'], generator.classes))
+        for stage in STAGES:
+            print('{:<12} {:>8.1f} ms {:>10.0f} lines/s {:>10.0f} tokens/s'
+                  .format(stage, results[stage]['seconds'] * 1000,
+                          results[stage]['linesPerSec'],
+                          results[stage]['tokensPerSec']))
+        print('{:<12} {:>8.1f} KiB peak'.format(
+            'memory', results['peakMemory'] / 1024))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baselineFile:
+            json.dump(results, baselineFile, indent=1)
+        return
+
+    if not os.path.isfile(args.baseline):
+        return
+
+    with open(args.baseline, 'r') as baselineFile:
+        baseline = json.load(baselineFile)
+    if baseline['corpus'] != results['corpus'] \
+            or baseline.get('options') != results['options']:
+        print('The baseline was measured on a different corpus or options, '
+              'not comparing')
+        return
+    elif 'calibrationSeconds' not in baseline:
+        print('The baseline has no calibration run, save it again with '
+              '--save-baseline')
+        return
+
+    report, regressed = compare(results, baseline, args.tolerance)
+    print('\nAgainst {}:'.format(args.baseline))
+    print('\n'.join(report))
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import os
+import random
+
+# Deterministic generator of synthetic, compilable Jack classes. The same
+# parameters and seed always give the same sources
+
+DEFAULTS = {'classes': 20,
+            'subroutines': 20,
+            'depth': 3,
+            'strings': 0.2,
+            'arrays': 0.3,
+            'seed': 1}
+
+WORDS = ('alpha', 'beta', 'gamma', 'delta', 'value', 'total', 'count',
+         'done', 'error', 'result', 'index', 'item')
+
+
+class CorpusGenerator:
+
+    # strings and arrays are the probabilities of a statement printing a
+    # string literal, and of a statement or term using an array
+    def __init__(self, classes=DEFAULTS['classes'],
+                 subroutines=DEFAULTS['subroutines'], depth=DEFAULTS['depth'],
+                 strings=DEFAULTS['strings'], arrays=DEFAULTS['arrays'],
+                 seed=DEFAULTS['seed']):
+        self.classes = classes
+        self.subroutines = subroutines
+        self.depth = depth
+        self.strings = strings
+        self.arrays = arrays
+        self.seed = seed
+
+    def params(self):
+        return {'classes': self.classes, 'subroutines': self.subroutines,
+                'depth': self.depth, 'strings': self.strings,
+                'arrays': self.arrays, 'seed': self.seed}
+
+    def generate(self):
+        # A {class name: source} dict, always with a Main class
+        sources = dict()
+        for c in range(self.classes):
+            name = 'Main' if c == 0 else 'Gen{}'.format(c)
+            rng = random.Random('{}/{}'.format(self.seed, c))
+            sources[name] = ClassWriter(self, name, rng).write()
+
+        return sources
+
+    def writeTo(self, dirPath):
+        os.makedirs(dirPath, exist_ok=True)
+        for name, source in self.generate().items():
+            with open(os.path.join(dirPath, name + '.jack'), 'w') as file:
+                file.write(source)
+
+
+class ClassWriter:
+
+    INTS = ('a', 'b', 'x', 'y', 'i')
+    LOOP_VARS = ('i', 'j', 'k')
+    FIELDS = ('f0', 'f1', 's0')
+
+    def __init__(self, generator, name, rng):
+        self.generator = generator
+        self.name = name
+        self.random = rng
+        self.lines = []
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line if line else '')
+
+    def write(self):
+        count = self.generator.subroutines
+        self.emit(0, '// Generated class {}'.format(self.name))
+        self.emit(0, 'class {} {{'.format(self.name))
+        self.emit(1, 'field int f0, f1;')
+        self.emit(1, 'static int s0;')
+        self.emit(1, '')
+
+        self.emit(1, 'constructor {} new() {{'.format(self.name))
+        self.emit(2, 'let f0 = 0;')
+        self.emit(2, 'let f1 = 1;')
+        self.emit(2, 'return this;')
+        self.emit(1, '}')
+
+        if self.name == 'Main':
+            self.emit(1, '')
+            self.emit(1, 'function void main() {')
+            self.emit(2, 'var Main m;')
+            self.emit(2, 'let m = Main.new();')
+            for i in range(count):
+                self.emit(2, 'do m.m{}({}, {});'.format(
+                    i, self.random.randint(0, 9), self.random.randint(0, 9)))
+            self.emit(2, 'return;')
+            self.emit(1, '}')
+
+        for i in range(count):
+            self.emit(1, '')
+            self.writeMethod(i)
+
+        self.emit(0, '}')
+        return '\n'.join(self.lines) + '\n'
+
+    def writeMethod(self, i):
+        self.emit(1, '/** Method {} of {} */'.format(i, self.name))
+        self.emit(1, 'method int m{}(int a, int b) {{'.format(i))
+        self.emit(2, 'var int x, y, i, j, k;')
+        self.emit(2, 'var Array arr;')
+        self.emit(2, 'let arr = Array.new(16);')
+        self.emit(2, 'let x = {};'.format(
+            self.expression(self.generator.depth)))
+        self.emit(2, 'let y = 0;')
+        self.called = False
+        for _ in range(self.random.randint(3, 6)):
+            self.writeStatement(2, i, 1)
+        self.emit(2, 'do arr.dispose();')
+        self.emit(2, 'return x + y;')
+        self.emit(1, '}')
+
+    def writeStatement(self, indent, i, nesting):
+        kind = self.random.random()
+        depth = self.generator.depth
+
+        if kind < self.generator.strings:
+            self.emit(indent, 'do Output.printString("{} {}");'.format(
+                self.random.choice(WORDS), self.random.randint(0, 999)))
+        elif kind < self.generator.strings + self.generator.arrays:
+            self.emit(indent, 'let arr[{}] = {};'.format(
+                self.index(), self.expression(depth)))
+        elif nesting <= len(self.LOOP_VARS) and kind < 0.7:
+            var = self.LOOP_VARS[nesting - 1]
+            self.emit(indent, 'let {} = 0;'.format(var))
+            self.emit(indent, 'while ({} < {}) {{'.format(
+                var, self.random.randint(2, 10)))
+            self.writeStatement(indent + 1, i, nesting + 1)
+            self.emit(indent + 1, 'let {0} = {0} + 1;'.format(var))
+            self.emit(indent, '}')
+        elif nesting < 3 and kind < 0.85:
+            self.emit(indent, 'if ({} < {}) {{'.format(
+                self.expression(1), self.expression(depth)))
+            self.writeStatement(indent + 1, i, nesting + 1)
+            self.emit(indent, '} else {')
+            self.writeStatement(indent + 1, i, nesting + 1)
+            self.emit(indent, '}')
+        elif i > 0 and nesting == 1 and not self.called and kind < 0.9:
+            # A single call per method, to the previous one and outside of
+            # loops, so the generated programs also run in linear time
+            self.called = True
+            self.emit(indent, 'let y = m{}({}, {});'.format(
+                i - 1, self.expression(1), self.expression(1)))
+        else:
+            target = self.random.choice(('x', 'y', 'f0', 'f1', 's0'))
+            self.emit(indent, 'let {} = {};'.format(
+                target, self.expression(depth)))
+
+    def index(self):
+        return '{} & 15'.format(self.term(0))
+
+    def expression(self, depth):
+        terms = [self.term(depth)]
+        for _ in range(self.random.randint(0, 2)):
+            terms.append(self.random.choice('+-*&|'))
+            terms.append(self.term(depth))
+        return ' '.join(terms)
+
+    def term(self, depth):
+        kind = self.random.random()
+        if depth > 0 and kind < 0.3:
+            return '({})'.format(self.expression(depth - 1))
+        elif depth > 0 and kind < 0.4:
+            return '-{}'.format(self.term(depth - 1))
+        elif depth > 0 and kind < 0.4 + self.generator.arrays / 2:
+            return 'arr[{}]'.format(self.index())
+        elif kind < 0.75:
+            return self.random.choice(self.INTS + self.FIELDS)
+
+        return str(self.random.randint(0, 100))
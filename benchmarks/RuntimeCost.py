@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from JackCorpus import CorpusGenerator, DEFAULTS
+from JackProgram import JackProgram, ENTRY_POINT, INLINE_SIZE
+from VMInterpreter import VMInterpreter, HEAP_BASE
+
+# The compile options compared, by name, with the inline size of each
+VARIANTS = (('plain', {}, None),
+            ('-O', {'optimize': True}, None),
+            ('-O --inline', {'optimize': True}, INLINE_SIZE),
+            ('-O --pool', {'optimize': True, 'poolStrings': True}, None))
+
+
+def runVariant(sources, options, inlineSize, maxSteps):
+    program = JackProgram(options)
+    for name, source in sources.items():
+        program.addSource(name + '.jack', source)
+    if inlineSize:
+        program.inline(inlineSize)
+
+    interpreter = VMInterpreter(program.functions(), maxSteps)
+    finished = interpreter.run(ENTRY_POINT)
+    return interpreter, finished
+
+
+def finalState(interpreter):
+    # What the program left behind, that every variant must agree on
+    return (interpreter.output, interpreter.statics(),
+            interpreter.ram[HEAP_BASE:interpreter.os.heapTop])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the instructions executed by the code of each '
+                    'compile option, over a synthetic Jack corpus')
+    for name, default in DEFAULTS.items():
+        parser.add_argument('--' + name, type=type(default), default=default)
+    parser.add_argument('--max-steps', type=int, default=10 ** 7)
+    args = parser.parse_args()
+
+    generator = CorpusGenerator(**{name: getattr(args, name)
+                                   for name in DEFAULTS})
+    sources = generator.generate()
+
+    reference = None
+    baseSteps = None
+    print('{:<14} {:>12} {:>8}'.format('variant', 'instructions', 'ratio'))
+    for name, options, inlineSize in VARIANTS:
+        interpreter, finished = runVariant(sources, options, inlineSize,
+                                           args.max_steps)
+        if not finished:
+            print('{:<14} did not finish in {} instructions'.format(
+                name, args.max_steps))
+            sys.exit(1)
+
+        state = finalState(interpreter)
+        if options.get('poolStrings') and reference is not None:
+            # Pooled literals are kept in statics and allocated only once,
+            # only the output can be the same
+            state, expected = state[0], reference[0]
+        else:
+            expected = reference
+
+        if reference is None:
+            reference = state
+            baseSteps = interpreter.steps
+        elif state != expected:
+            print('{:<14} computed something else than plain code'.format(
+                name))
+            sys.exit(1)
+
+        print('{:<14} {:>12} {:>7.3f}x'.format(
+            name, interpreter.steps, interpreter.steps / baseSteps))
+
+
+if __name__ == '__main__':
+    main()
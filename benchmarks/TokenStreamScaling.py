@@ -0,0 +1,65 @@
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from JackTokenizer import JackTokenizer
+from CompilationEngine import CompilationEngine
+
+# A subroutine body repeated to grow a single class to the wanted size
+SUBROUTINE = '''
+    function int f{0}(Array a, int n) {{
+        var int i, sum;
+        let i = 0;
+        let sum = 0;
+        while (i < n) {{
+            let a[i] = (n - i) * 3;
+            let sum = sum + a[i];
+            let i = i + 1;
+        }}
+        if (sum > 100) {{
+            do Output.printString("big");
+        }}
+        return sum;
+    }}
+'''
+
+SIZES = [2500, 5000, 10000, 20000]
+
+
+def generateClass(lines):
+    subroutineLines = SUBROUTINE.count('\n')
+    count = max(1, lines // subroutineLines)
+    body = ''.join(SUBROUTINE.format(i) for i in range(count))
+    return 'class Scaling {{\n{}}}\n'.format(body)
+
+
+def timeCompile(source):
+    start = time.perf_counter()
+    tokenizer = JackTokenizer(source)
+    CompilationEngine(tokenizer, io.StringIO()).compileClass()
+    return time.perf_counter() - start, len(tokenizer.tokens)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+
+    print('{:>8} {:>8} {:>10} {:>14}'.format(
+        'lines', 'tokens', 'seconds', 'usec/token'))
+    perToken = []
+    for lines in sizes:
+        source = generateClass(lines)
+        seconds, tokens = timeCompile(source)
+        perToken.append(seconds / tokens)
+        print('{:>8} {:>8} {:>10.3f} {:>14.3f}'.format(
+            source.count('\n'), tokens, seconds, perToken[-1] * 1e6))
+
+    # Linear time keeps the cost per token flat as the input grows
+    print('cost per token, largest/smallest: {:.2f}x'.format(
+        perToken[-1] / perToken[0]))
+
+
+if __name__ == '__main__':
+    main()
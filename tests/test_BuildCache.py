@@ -0,0 +1,74 @@
+import pytest
+from BuildCache import BuildCache, hashFile
+from JackCompiler import COMPILER_VERSION, compileSources
+
+SOURCE = '''class Main {
+    function void main() {
+        return;
+    }
+}
+'''
+
+
+@pytest.fixture
+def built(tmp_path):
+    # A compiled class, recorded in a saved manifest
+    fp = tmp_path / 'Main.jack'
+    fp.write_text(SOURCE)
+    (tmp_path / 'Main.vm').write_text('function Main.main 0\n')
+
+    cache = BuildCache(str(tmp_path), '1.0', {'optimize': True})
+    cache.record(str(fp), hashFile(str(fp)))
+    cache.save()
+    return tmp_path, str(fp)
+
+
+def test_unchanged_build_is_valid(built):
+    outputDir, fp = built
+    cache = BuildCache(str(outputDir), '1.0', {'optimize': True})
+    assert cache.isValid(fp, hashFile(fp))
+
+
+def test_version_change_invalidates(built):
+    outputDir, fp = built
+    cache = BuildCache(str(outputDir), '1.1', {'optimize': True})
+    assert not cache.isValid(fp, hashFile(fp))
+
+
+def test_settings_change_invalidates(built):
+    outputDir, fp = built
+    for settings in ({}, {'optimize': True, 'poolStrings': True}):
+        cache = BuildCache(str(outputDir), '1.0', settings)
+        assert not cache.isValid(fp, hashFile(fp))
+
+
+def test_source_change_invalidates(built):
+    outputDir, fp = built
+    cache = BuildCache(str(outputDir), '1.0', {'optimize': True})
+    assert not cache.isValid(fp, hashFile(fp) + '0')
+
+
+def test_edited_output_invalidates(built):
+    outputDir, fp = built
+    (outputDir / 'Main.vm').write_text('return\n')
+    cache = BuildCache(str(outputDir), '1.0', {'optimize': True})
+    assert not cache.isValid(fp, hashFile(fp))
+
+
+def test_incremental_build_rebuilds_on_new_options(tmp_path, capsys):
+    fp = tmp_path / 'Main.jack'
+    fp.write_text(SOURCE)
+    sources = [str(fp)]
+
+    assert compileSources(sources, incremental=True)
+    assert compileSources(sources, incremental=True)
+    assert compileSources(sources, incremental=True,
+                          options={'optimize': True})
+    reports = capsys.readouterr().out.splitlines()
+    assert reports == ['1 rebuilt, 0 cached, 0 failed',
+                       '0 rebuilt, 1 cached, 0 failed',
+                       '1 rebuilt, 0 cached, 0 failed']
+
+    manifest = BuildCache(str(tmp_path), COMPILER_VERSION,
+                          {'optimize': True})
+    assert manifest.isValid(str(fp), hashFile(str(fp)))
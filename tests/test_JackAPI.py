@@ -0,0 +1,53 @@
+import pytest
+from CompilationTypes import JackError, JackSyntaxError
+from JackAPI import compileSources, compileString
+
+VALID = '''class Main {
+    function void main() {
+        do Output.printInt(1);
+        return;
+    }
+}
+'''
+
+
+def test_compiles_a_class():
+    assert compileString(VALID).startswith('function Main.main 0\n')
+
+
+@pytest.mark.parametrize('source, message', [
+    ('class Main {\n  function void main() { let s = "open; }\n}\n',
+     'unterminated string at line 2, column 34'),
+    ('class Main {\n  function void main() { return; }\n  ?\n}\n',
+     'unknown token ? at line 3, column 3'),
+    ('klass Main {}', "expected 'class', found klass at line 1, column 1"),
+    ('class Main {\n  function void main() { return; }\n',
+     "expected '}' closing the class at the end of the file"),
+    ('class Main {\n}\nclass Other {}',
+     'expected the end of the file, found class at line 3, column 1'),
+])
+def test_raises_syntax_errors(source, message):
+    with pytest.raises(JackSyntaxError) as error:
+        compileString(source, fileName='Main.jack')
+    assert error.value.message == message
+    assert str(error.value) == 'Main.jack: ' + message
+
+
+def test_parse_failure_is_a_syntax_error():
+    # The engine doesn't check every rule, where it fails further on the
+    # position of the token it stopped at is reported
+    with pytest.raises(JackSyntaxError) as error:
+        compileString('class Main {\n  function void main() {\n'
+                      '    let x = (1 + ;\n  }\n}\n')
+    assert (error.value.line, error.value.column) == (5, 1)
+
+    with pytest.raises(JackSyntaxError, match='unexpected end of file'):
+        compileString('class Main {\n  function void main() {\n    let x =')
+
+
+def test_project_keeps_compiling_past_errors():
+    result = compileSources({'Main.jack': VALID,
+                             'Bad.jack': 'class Bad { "oops }'})
+    assert list(result.files) == ['Main.vm']
+    assert list(result.errors) == ['Bad.jack']
+    assert isinstance(result.errors['Bad.jack'], JackError)
@@ -0,0 +1,145 @@
+from HackWriter import parseVM
+from JackProgram import JackProgram
+from VMInterpreter import VMInterpreter
+
+# A leaf function, small enough to inline, that keeps its argument in temp
+DOUBLE = '''
+function Small.double 0
+push argument 0
+push argument 0
+add
+return
+'''
+
+
+def vmProgram(**classes):
+    # A program of VM code, {class name: VM text}
+    program = JackProgram()
+    for name, source in classes.items():
+        program.classes[name + '.vm'] = {}
+        for instruction in parseVM(source):
+            if instruction[0] == 'function':
+                function = program.classes[name + '.vm'][instruction[1]] = []
+            function.append(instruction)
+    return program
+
+
+def run(program):
+    interpreter = VMInterpreter(program.functions(), 10 ** 5)
+    assert interpreter.run('Main.main')
+    return interpreter.statics()
+
+
+def test_inlines_call_without_live_scratch():
+    program = vmProgram(Small=DOUBLE, Main='''
+        function Main.main 0
+        push constant 21
+        call Small.double 1
+        pop static 0
+        push constant 0
+        return
+        ''')
+    assert program.inline() == {'Small.double': 1}
+    assert run(program) == {'Main.0': 42}
+
+
+def test_keeps_call_with_live_temp():
+    # temp 0 holds a value across the call, the inlined argument would
+    # overwrite it
+    program = vmProgram(Small=DOUBLE, Main='''
+        function Main.main 0
+        push constant 5
+        pop temp 0
+        push constant 21
+        call Small.double 1
+        push temp 0
+        add
+        pop static 0
+        push constant 0
+        return
+        ''')
+    expected = run(program)
+    assert program.inline() == {}
+    assert run(program) == expected == {'Main.0': 47}
+
+
+def test_keeps_call_with_live_pointer():
+    # pointer 1 is read through that after the call, and the inlined method
+    # puts its object there
+    program = vmProgram(Small='''
+        function Small.get 0
+        push argument 0
+        pop pointer 0
+        push this 0
+        return
+        ''', Main='''
+        function Main.main 0
+        push constant 2
+        call Memory.alloc 1
+        pop pointer 1
+        push constant 9
+        pop that 0
+        push constant 2
+        call Memory.alloc 1
+        call Small.get 1
+        push that 0
+        add
+        pop static 0
+        push constant 0
+        return
+        ''')
+    assert program.inline() == {}
+    assert run(program) == {'Main.0': 9}
+
+
+def test_keeps_call_with_scratch_live_past_a_label():
+    # temp 0 is only read after a branch, from wherever control goes
+    program = vmProgram(Small=DOUBLE, Main='''
+        function Main.main 0
+        push constant 5
+        pop temp 0
+        push constant 21
+        call Small.double 1
+        pop static 0
+        label L0
+        push temp 0
+        pop static 1
+        push constant 0
+        return
+        ''')
+    assert program.inline() == {}
+    assert run(program) == {'Main.0': 42, 'Main.1': 5}
+
+
+def test_inlined_jack_program_computes_the_same():
+    source = '''
+    class Main {
+        field int x;
+        static int total;
+
+        constructor Main new(int v) { let x = v; return this; }
+        method int get() { return x; }
+        function int twice(int n) { return n + n; }
+
+        function void main() {
+            var Main m;
+            var Array a;
+            let m = Main.new(3);
+            let a = Array.new(4);
+            let a[1] = Main.twice(m.get());
+            let a[2] = a[1] * 4;
+            let total = a[2] + Main.twice(a[1]) + m.get();
+            return;
+        }
+    }
+    '''
+    results = []
+    for options, inlineSize in (({}, None), ({'optimize': True}, 8)):
+        program = JackProgram(options)
+        program.addSource('Main.jack', source)
+        if inlineSize:
+            assert program.inline(inlineSize)
+        results.append(run(program))
+
+    assert results[0] == results[1]
+    assert results[0]['Main.0'] == 3 * 2 * 4 + 12 + 3
@@ -0,0 +1,62 @@
+import pytest
+from CompilationTypes import JackSyntaxError
+from JackTokenizer import JackTokenizer, JackTokenStream
+
+SOURCE = '''// A class whose tokens straddle any chunk size
+class Main {
+    /* a block comment,
+       over two lines */
+    static int count; // café
+    function void main() {
+        var String s;
+        let s = "naïve // not a comment";
+        let count = count + 12345 - (3 * 4);
+        do Output.printString(s);
+        return;
+    }
+}
+'''
+
+
+def positions(tokens):
+    return [(token.type, token.value, token.line, token.column)
+            for token in tokens]
+
+
+def streamTokens(fp, chunkSize):
+    stream = JackTokenStream(str(fp), chunkSize)
+    tokens = []
+    while stream.curToken() is not None:
+        tokens.append(stream.advance())
+    return tokens
+
+
+@pytest.mark.parametrize('chunkSize', [1, 2, 3, 5, 7, 16, 64, 1 << 16])
+def test_stream_matches_tokenizer(tmp_path, chunkSize):
+    fp = tmp_path / 'Main.jack'
+    fp.write_text(SOURCE, encoding='utf-8')
+
+    expected = positions(JackTokenizer(SOURCE).tokens)
+    assert positions(streamTokens(fp, chunkSize)) == expected
+
+
+def test_stream_of_empty_file(tmp_path):
+    fp = tmp_path / 'Empty.jack'
+    fp.write_text('')
+    assert streamTokens(fp, 4) == []
+
+
+@pytest.mark.parametrize('chunkSize', [1, 4, 1 << 16])
+def test_stream_reports_unterminated_string(tmp_path, chunkSize):
+    fp = tmp_path / 'Bad.jack'
+    fp.write_text('class Bad {\n  let s = "open;\n}\n')
+
+    with pytest.raises(JackSyntaxError) as error:
+        streamTokens(fp, chunkSize)
+    assert (error.value.line, error.value.column) == (2, 11)
+
+
+def test_tokens_compare_as_pairs():
+    token = JackTokenizer('class').tokens[0]
+    assert token == ('keyword', 'class')
+    assert (token.line, token.column) == (1, 1)
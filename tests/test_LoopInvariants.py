@@ -0,0 +1,42 @@
+from LoopInvariants import findInvariants
+
+
+def code(text):
+    return [tuple((line.split() + [None, None])[:3])
+            for line in text.strip().splitlines()]
+
+
+def test_constants_alone_are_not_hoisted():
+    assert findInvariants(code('''
+        push constant 5
+        push constant 3
+        add
+        pop local 0
+        ''')) == []
+
+
+def test_expression_reading_a_variable_is_hoisted():
+    assert findInvariants(code('''
+        push argument 0
+        push constant 3
+        add
+        pop local 0
+        ''')) == [(0, 3)]
+
+
+def test_pure_call_is_hoisted():
+    assert findInvariants(code('''
+        push constant 5
+        push constant 3
+        call Math.multiply 2
+        pop local 0
+        ''')) == [(0, 3)]
+
+
+def test_variable_written_in_the_loop_is_not_hoisted():
+    assert findInvariants(code('''
+        push local 0
+        push constant 3
+        add
+        pop local 0
+        ''')) == []
@@ -0,0 +1,37 @@
+import pytest
+from HackWriter import parseVM
+from VMInterpreter import VMError, VMInterpreter
+
+
+def run(source):
+    interpreter = VMInterpreter({'Main.main': parseVM(source)}, 10 ** 4)
+    return interpreter.run('Main.main')
+
+
+@pytest.mark.parametrize('access', [
+    'pop pointer 1\npush that 0\npop temp 0',
+    'pop pointer 1\npush constant 1\npop that 0',
+    'push constant 1\ncall Memory.poke 2\npop temp 0',
+])
+def test_negative_address_is_an_error(access):
+    # Instead of reaching the top of RAM through Python's negative indexing
+    with pytest.raises(VMError, match='address out of range -5'):
+        run('''
+            function Main.main 0
+            push constant 5
+            neg
+            %s
+            push constant 0
+            return
+            ''' % access)
+
+
+def test_address_past_ram_is_an_error():
+    with pytest.raises(VMError, match='address out of range'):
+        run('''
+            function Main.main 0
+            push constant 32767
+            pop pointer 1
+            push that 1
+            return
+            ''')
@@ -0,0 +1,178 @@
+import pytest
+from HackWriter import parseVM
+from JackProgram import JackProgram
+from VMInterpreter import VMInterpreter
+from VMOptimizer import VMOptimizer
+
+# For every rule, a Main.main that it rewrites, leaving its result in
+# statics
+RULE_PROGRAMS = {
+    'push-pop': '''
+        function Main.main 1
+        push constant 7
+        pop local 0
+        push local 0
+        pop local 0
+        push local 0
+        pop static 0
+        push constant 0
+        return
+        ''',
+    'double-not': '''
+        function Main.main 0
+        push constant 5
+        not
+        not
+        pop static 0
+        push constant 0
+        return
+        ''',
+    'array-store-temp': '''
+        function Main.main 1
+        push constant 3
+        call Array.new 1
+        pop local 0
+        push local 0
+        push constant 2
+        add
+        push constant 9
+        pop temp 0
+        pop pointer 1
+        push temp 0
+        pop that 0
+        push local 0
+        push constant 2
+        add
+        pop pointer 1
+        push that 0
+        pop static 0
+        push constant 0
+        return
+        ''',
+    'unreachable-code': '''
+        function Main.main 0
+        push constant 4
+        pop static 0
+        goto END
+        push constant 5
+        pop static 0
+        label END
+        push constant 0
+        return
+        ''',
+    'jump-to-next': '''
+        function Main.main 0
+        push constant 1
+        pop static 0
+        goto NEXT
+        label NEXT
+        push constant 0
+        return
+        ''',
+}
+
+
+def runStatics(instructions):
+    interpreter = VMInterpreter({'Main.main': instructions}, 10 ** 5)
+    assert interpreter.run('Main.main')
+    return interpreter.statics()
+
+
+@pytest.mark.parametrize('rule', sorted(RULE_PROGRAMS))
+def test_rule_keeps_the_result(rule):
+    instructions = parseVM(RULE_PROGRAMS[rule])
+    optimizer = VMOptimizer()
+    optimized = optimizer.optimize(instructions)
+
+    assert optimizer.stats()[rule] > 0
+    assert len(optimized) < len(instructions)
+    assert runStatics(optimized) == runStatics(instructions)
+
+
+def test_every_rule_is_covered():
+    assert set(VMOptimizer().stats()) == set(RULE_PROGRAMS)
+
+
+def test_optimized_jack_program_computes_the_same():
+    source = '''
+    class Main {
+        static Array table;
+        static int total;
+
+        function int id(int n) { return n; }
+
+        function int pick(int n) {
+            if (n > 3) { return n; }
+            return -n;
+        }
+
+        function void main() {
+            var int i, x;
+            let table = Array.new(8);
+            let i = 0;
+            while (i < 8) {
+                let table[Main.id(i)] = i * 3;
+                let x = ~(~i);
+                let x = x;
+                if (~(i = 2)) { let total = total + table[i]; }
+                else { let total = total - 1; }
+                let i = i + 1;
+            }
+            let total = total + Main.pick(2) + Main.pick(5);
+            return;
+        }
+    }
+    '''
+    results = []
+    for options in ({}, {'optimize': True}):
+        program = JackProgram(options)
+        program.addSource('Main.jack', source)
+        interpreter = VMInterpreter(program.functions(), 10 ** 6)
+        assert interpreter.run('Main.main')
+        results.append(interpreter.statics())
+
+    assert results[0] == results[1]
+    assert results[0]['Main.1'] == 3 * (0 + 1 + 3 + 4 + 5 + 6 + 7) - 1 + 3
+
+
+@pytest.mark.parametrize('statement', [
+    'let y = (a[0] * 0) + a[0];',
+    'let y = (a[i] & 0) + a[i];',
+    'let y = (a[i] | -1) + a[i];',
+    'let y = (~0) & ((~0) & a[i]); let y = y + a[i];',
+    'let y = ~b[((i * 0 * b[0]) & 7)] + a[3];',
+])
+def test_folded_array_read_before_another_read(statement):
+    # A fold dropping code before the array base in pointer 1 must not
+    # leave a later read of the same array reusing it
+    source = '''
+    class Main {
+        static int result;
+
+        function void main() {
+            var Array a, b;
+            var int i, y;
+            let a = Array.new(8);
+            let b = Array.new(8);
+            let i = 1;
+            let a[0] = 7;
+            let a[1] = 8;
+            let a[3] = 9;
+            let b[0] = 3;
+            let b[1] = 4;
+            %s
+            let result = y;
+            return;
+        }
+    }
+    ''' % statement
+    results = []
+    for options in ({}, {'optimize': True},
+                    {'optimize': True, 'iterative': True}):
+        program = JackProgram(options)
+        program.addSource('Main.jack', source)
+        interpreter = VMInterpreter(program.functions(), 10 ** 6)
+        assert interpreter.run('Main.main')
+        results.append(interpreter.statics())
+
+    assert results[0] == results[1] == results[2]